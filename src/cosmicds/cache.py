@@ -0,0 +1,103 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable
+
+__all__ = ["ResponseCache"]
+
+_MISSING = object()
+
+
+class ResponseCache:
+    """
+    A size-bounded LRU cache whose entries each carry their own time-to-live,
+    with single-flight loading: concurrent loads of the same key share one
+    call to the loader.
+
+    This is not thread-safe. All access must happen from the same event loop
+    (for the API, the `cosmicds.remote.APIClient` loop).
+
+    Parameters
+    ----------
+    maxsize : int
+        The maximum number of entries to keep. The least recently used entry
+        is evicted when this is exceeded.
+    clock : callable
+        Returns the current time in seconds. Defaults to `time.monotonic`.
+    """
+
+    def __init__(self, maxsize: int = 1024, clock: Callable[[], float] = time.monotonic):
+        self.maxsize = maxsize
+        self._clock = clock
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._inflight: dict[Hashable, asyncio.Future] = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def get(self, key: Hashable, default=None, allow_stale: bool = False):
+        """
+        Returns the value cached for ``key``, or ``default`` if there is none.
+        Expired entries are only returned if ``allow_stale`` is True.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+
+        expires, value = entry
+        if not allow_stale and expires <= self._clock():
+            return default
+
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: float):
+        self._entries[key] = (self._clock() + ttl, value)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    async def get_or_load(
+        self,
+        key: Hashable,
+        loader: Callable[[], Awaitable[tuple[Any, float | None]]],
+    ):
+        """
+        Returns the fresh cached value for ``key`` if there is one. Otherwise,
+        awaits ``loader``, which should return a ``(value, ttl)`` pair; the
+        value is cached for ``ttl`` seconds unless ``ttl`` is falsy.
+
+        If a load for ``key`` is already in flight, this waits for that load
+        instead of starting another.
+        """
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._load(key, loader))
+            self._inflight[key] = task
+
+        # Shield the shared load so that one caller being cancelled does not
+        # cancel it for everyone else waiting on it
+        return await asyncio.shield(task)
+
+    async def _load(self, key, loader):
+        try:
+            value, ttl = await loader()
+            if ttl:
+                self.set(key, value, ttl)
+            return value
+        finally:
+            del self._inflight[key]
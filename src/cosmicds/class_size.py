@@ -0,0 +1,161 @@
+import asyncio
+import threading
+from typing import Callable
+
+import httpx
+
+from .logger import setup_logger
+
+__all__ = ["ClassSizeService"]
+
+logger = setup_logger("CLASS SIZE")
+
+
+class _Poller:
+    """Handle on the background task polling one class."""
+
+    future = None
+
+
+class ClassSizeService:
+    """
+    Process-wide watcher of class sizes.
+
+    Sessions subscribe to a class, and a single background task per class
+    (on the API client loop) polls its size, so upstream load grows with the
+    number of active classes rather than the number of students. When the
+    size changes, every subscriber's callback is called with it, on a worker
+    thread and inside the kernel context the subscriber was registered from.
+
+    Parameters
+    ----------
+    api : `AsyncBaseAPI`
+        The API to poll through.
+    interval : float
+        Seconds between polls of each class.
+    long_poll : float
+        If nonzero, each poll asks the server to hold the request for up to
+        this many seconds until the size changes, and the next poll follows
+        immediately. Servers that don't hold requests answer at once, in
+        which case polls are spaced by ``interval`` as usual.
+    """
+
+    def __init__(self, api, interval: float = 5.0, long_poll: float = 0.0):
+        self.api = api
+        self.interval = interval
+        self.long_poll = long_poll
+        self._lock = threading.Lock()
+        self._subscribers: dict[int, dict[object, tuple]] = {}
+        self._pollers: dict[int, _Poller] = {}
+        self._sizes: dict[int, int] = {}
+
+    def latest(self, class_id: int) -> int | None:
+        """The last size seen for a class that is being watched, if any."""
+        return self._sizes.get(class_id)
+
+    def subscribe(
+        self,
+        class_id: int,
+        callback: Callable[[int], None],
+        context=None,
+        owner: str | None = None,
+    ) -> Callable[[], None]:
+        """
+        Calls ``callback`` with the size of the class whenever it changes,
+        and right away if it is already known. If given, ``context`` is
+        entered around each call. Returns a function that unsubscribes.
+        """
+        token = object()
+
+        with self._lock:
+            self._subscribers.setdefault(class_id, {})[token] = (callback, context, owner)
+
+            if class_id not in self._pollers:
+                poller = _Poller()
+                self._pollers[class_id] = poller
+                poller.future = self.api.client.submit(self._poll(class_id, poller))
+
+            size = self._sizes.get(class_id)
+
+        if size is not None:
+            self._call(callback, context, size)
+
+        return lambda: self._unsubscribe(class_id, token)
+
+    def _unsubscribe(self, class_id: int, token: object):
+        with self._lock:
+            subscribers = self._subscribers.get(class_id, {})
+            subscribers.pop(token, None)
+
+            if not subscribers:
+                self._stop(class_id)
+
+    def unsubscribe_owner(self, owner: str | None):
+        """Drops every subscription made for the session ``owner``."""
+        with self._lock:
+            for class_id, subscribers in list(self._subscribers.items()):
+                for token, (_, _, subscriber) in list(subscribers.items()):
+                    if subscriber == owner:
+                        del subscribers[token]
+
+                if not subscribers:
+                    self._stop(class_id)
+
+    def _stop(self, class_id: int):
+        # Called with the lock held
+        self._subscribers.pop(class_id, None)
+        self._sizes.pop(class_id, None)
+        poller = self._pollers.pop(class_id, None)
+        if poller is not None and poller.future is not None:
+            # Also wakes a long poll that is waiting on the server
+            poller.future.cancel()
+
+    async def _poll(self, class_id: int, poller: _Poller):
+        # Always runs on the client loop
+        known = None
+
+        while self._pollers.get(class_id) is poller:
+            started = asyncio.get_running_loop().time()
+
+            try:
+                size = await self.api.poll_class_size(
+                    class_id, known=known, wait=self.long_poll
+                )
+            except (httpx.HTTPError, KeyError, ValueError) as e:
+                logger.warning("Failed to poll the size of class %s: %s", class_id, e)
+                await asyncio.sleep(self.interval)
+                continue
+
+            changed = size != known
+            if changed:
+                known = size
+                with self._lock:
+                    if self._pollers.get(class_id) is not poller:
+                        return
+                    self._sizes[class_id] = size
+                # Subscribers update reactive state, which mustn't hold up the loop
+                await asyncio.to_thread(self._notify, class_id, size)
+
+            # A long poll that ended in a change is followed by the next one
+            # right away; anything else waits out the rest of the interval
+            if not (self.long_poll and changed):
+                elapsed = asyncio.get_running_loop().time() - started
+                await asyncio.sleep(max(0.0, self.interval - elapsed))
+
+    def _notify(self, class_id: int, size: int):
+        with self._lock:
+            subscribers = list(self._subscribers.get(class_id, {}).values())
+
+        for callback, context, _ in subscribers:
+            self._call(callback, context, size)
+
+    @staticmethod
+    def _call(callback, context, size: int):
+        try:
+            if context is None:
+                callback(size)
+            else:
+                with context:
+                    callback(size)
+        except Exception as e:
+            logger.error("Failed to deliver class size: %s", e)
@@ -0,0 +1,100 @@
+"""
+Minimal JSON-patch (RFC 6902) style deltas between JSON documents, used to
+sync state documents with the API server without resending them in full.
+
+Only the ``add``, ``remove`` and ``replace`` operations are produced or
+understood.
+"""
+
+from copy import deepcopy
+from typing import Any
+
+__all__ = ["diff", "apply"]
+
+
+def _escape(key) -> str:
+    return str(key).replace("~", "~0").replace("/", "~1")
+
+
+def _unescape(token: str) -> str:
+    return token.replace("~1", "/").replace("~0", "~")
+
+
+def diff(old: Any, new: Any, path: str = "") -> list[dict]:
+    """
+    Returns the list of patch operations that turns ``old`` into ``new``.
+
+    Objects are compared key by key, and lists index by index (with items
+    appended to or removed from the end as needed), so the patch only
+    touches the values that actually differ.
+    """
+    if type(old) is type(new) and old == new:
+        return []
+
+    if isinstance(old, dict) and isinstance(new, dict):
+        ops = []
+        for key, value in new.items():
+            child = f"{path}/{_escape(key)}"
+            if key not in old:
+                ops.append({"op": "add", "path": child, "value": value})
+            else:
+                ops.extend(diff(old[key], value, child))
+        for key in old.keys() - new.keys():
+            ops.append({"op": "remove", "path": f"{path}/{_escape(key)}"})
+        return ops
+
+    if isinstance(old, list) and isinstance(new, list):
+        ops = []
+        common = min(len(old), len(new))
+        for index in range(common):
+            ops.extend(diff(old[index], new[index], f"{path}/{index}"))
+        for index in range(common, len(new)):
+            ops.append({"op": "add", "path": f"{path}/{index}", "value": new[index]})
+        # Remove from the end so that earlier indices stay valid
+        for index in reversed(range(common, len(old))):
+            ops.append({"op": "remove", "path": f"{path}/{index}"})
+        return ops
+
+    return [{"op": "replace", "path": path, "value": new}]
+
+
+def apply(doc: Any, ops: list[dict]) -> Any:
+    """
+    Returns a copy of ``doc`` with the patch operations ``ops`` applied.
+    ``doc`` itself is left unchanged.
+    """
+    doc = deepcopy(doc)
+
+    for op in ops:
+        tokens = [_unescape(t) for t in op["path"].split("/")[1:]]
+
+        if not tokens:
+            if op["op"] == "remove":
+                raise ValueError("Cannot remove the document root.")
+            doc = deepcopy(op["value"])
+            continue
+
+        parent = doc
+        for token in tokens[:-1]:
+            parent = parent[int(token)] if isinstance(parent, list) else parent[token]
+
+        last = tokens[-1]
+        if isinstance(parent, list):
+            index = len(parent) if last == "-" else int(last)
+            if op["op"] == "add":
+                parent.insert(index, deepcopy(op["value"]))
+            elif op["op"] == "replace":
+                parent[index] = deepcopy(op["value"])
+            elif op["op"] == "remove":
+                del parent[index]
+            else:
+                raise ValueError(f"Unsupported patch operation `{op['op']}`.")
+        else:
+            if op["op"] in ("add", "replace"):
+                parent[last] = deepcopy(op["value"])
+            elif op["op"] == "remove":
+                del parent[last]
+            else:
+                raise ValueError(f"Unsupported patch operation `{op['op']}`.")
+
+    return doc
@@ -0,0 +1,196 @@
+import os
+import threading
+from typing import Callable
+
+import solara
+from glue.core import DataCollection
+from glue_jupyter import JupyterApplication
+
+from .logger import setup_logger
+from .utils import get_kernel_context, get_kernel_id
+
+__all__ = [
+    "GlueAppRegistry",
+    "GluePluginWarmUp",
+    "GLUE_APPS",
+    "GLUE_WARM_UP",
+    "get_glue_app",
+]
+
+logger = setup_logger("GLUE")
+
+# Whether to load glue's plugins in the background at startup
+WARM_UP = os.getenv("CDS_GLUE_WARM_UP", "0") == "1"
+
+
+class GlueAppRegistry:
+    """
+    The glue application of each Solara session, created on first use and
+    torn down when the session's kernel shuts down.
+
+    Apps are keyed by kernel id rather than browser session id, since each
+    browser tab gets its own kernel (and its own widgets) even when tabs
+    share a session cookie. Outside of a kernel, e.g. in scripts, there is a
+    single app under the key `None`.
+
+    Parameters
+    ----------
+    factory : callable
+        Creates a new app.
+    """
+
+    def __init__(self, factory: Callable[[], JupyterApplication] = JupyterApplication):
+        self.factory = factory
+        self._lock = threading.Lock()
+        self._apps: dict[str | None, JupyterApplication] = {}
+        self._sessions: dict[str | None, str | None] = {}
+
+    def get(self) -> JupyterApplication:
+        """Returns the glue app of the current session, creating it if needed."""
+        context = get_kernel_context()
+        key = context.id if context is not None else None
+
+        with self._lock:
+            app = self._apps.get(key)
+        if app is not None:
+            return app
+
+        # Building an app is slow, so don't hold up other sessions meanwhile;
+        # if this session raced itself, the first app in wins
+        app = self.factory()
+        with self._lock:
+            app = self._apps.setdefault(key, app)
+            self._sessions.setdefault(key, getattr(context, "session_id", None))
+
+        return app
+
+    def __len__(self):
+        return len(self._apps)
+
+    def memory_report(self) -> dict[str | None, dict]:
+        """
+        Per kernel: the session it belongs to, and the datasets, subsets,
+        viewers and hub subscribers of its glue app, along with the bytes
+        held by stored (not derived) component arrays.
+        """
+        with self._lock:
+            apps = list(self._apps.items())
+            sessions = dict(self._sessions)
+
+        return {
+            key: {"session": sessions.get(key), **_app_usage(app)}
+            for key, app in apps
+        }
+
+    def teardown(self, key: str | None):
+        """
+        Drops the app of the kernel ``key`` and frees what it holds: its
+        viewers and their figures are closed, every hub subscriber is
+        unsubscribed, and its data collection is emptied.
+        """
+        with self._lock:
+            app = self._apps.pop(key, None)
+            self._sessions.pop(key, None)
+
+        if app is None:
+            return
+
+        for viewer in app.viewers:
+            try:
+                viewer.cleanup()
+                figure = getattr(viewer, "figure", None)
+                if hasattr(figure, "close"):
+                    figure.close()
+            except Exception as e:
+                logger.warning("Failed to clean up viewer `%s`: %s", viewer, e)
+
+        hub = app.session.hub
+        for subscriber in list(hub._subscriptions.keys()):
+            hub.unsubscribe_all(subscriber)
+
+        app.data_collection.clear()
+        logger.info("Tore down glue app of kernel `%s`.", key)
+
+
+class GluePluginWarmUp:
+    """
+    Loads glue's plugins on a background thread, ahead of the first app.
+
+    Loading the plugins, which happens when the first `JupyterApplication`
+    of a process is created, is by far the costliest part of creating one.
+    Building the apps themselves ahead of time isn't possible, since an app
+    creates widgets, which belong to the kernel they are created in.
+    """
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Starts loading the plugins in the background."""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(
+            target=self._load, name="cosmicds-glue-warm-up", daemon=True
+        )
+        self._thread.start()
+
+    def create_app(self) -> JupyterApplication:
+        """A new app, once the plugins are loaded, for use as a
+        `GlueAppRegistry` factory."""
+        # Don't race the background thread through loading plugins
+        self._done.wait()
+        return JupyterApplication()
+
+    def _load(self):
+        try:
+            from glue.main import load_plugins
+
+            load_plugins()
+        except Exception as e:
+            logger.warning("Failed to preload glue plugins: %s", e)
+        finally:
+            self._done.set()
+
+
+def _app_usage(app: JupyterApplication) -> dict:
+    data_collection: DataCollection = app.data_collection
+    nbytes = 0
+    subsets = 0
+
+    for data in data_collection:
+        subsets += len(data.subsets)
+        for cid in data.main_components + data.coordinate_components:
+            # Reading `.data` would compute derived components
+            array = getattr(data.get_component(cid), "_data", None)
+            nbytes += getattr(array, "nbytes", 0)
+
+    return {
+        "datasets": len(data_collection),
+        "subsets": subsets,
+        "viewers": len(app.viewers),
+        "hub_subscribers": len(app.session.hub._subscriptions),
+        "data_bytes": nbytes,
+    }
+
+
+GLUE_WARM_UP = GluePluginWarmUp() if WARM_UP else None
+if GLUE_WARM_UP is not None:
+    GLUE_WARM_UP.start()
+
+GLUE_APPS = GlueAppRegistry(
+    GLUE_WARM_UP.create_app if GLUE_WARM_UP is not None else JupyterApplication
+)
+
+
+def get_glue_app() -> JupyterApplication:
+    """Returns the glue app of the current session."""
+    return GLUE_APPS.get()
+
+
+def _on_session_start():
+    key = get_kernel_id()
+    return lambda: GLUE_APPS.teardown(key)
+
+
+solara.lab.on_kernel_start(_on_session_start)
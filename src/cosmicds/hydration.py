@@ -0,0 +1,166 @@
+"""
+Trusted, incremental restoring of pydantic state models from plain data.
+
+Validating a whole story state on every restore costs time proportional to
+the size of the model. For data that our own server sent back, which was
+produced by dumping the same models, that validation is redundant: here
+models are built with ``model_construct`` instead, guided by a per-class
+schema that is worked out once, and only the fields whose values actually
+differ are touched. Fields whose types need real conversion (anything that
+isn't plain JSON or a nested model) are still validated, field by field,
+through the model's own validator, so with its config and field validators.
+"""
+
+from functools import lru_cache
+from types import NoneType, UnionType
+from typing import Any, Union, get_args, get_origin
+
+from pydantic import BaseModel
+
+__all__ = ["construct", "hydrate"]
+
+# Annotations whose values come out of JSON already in the right form
+_PLAIN_TYPES = {str, int, float, bool, NoneType, dict, list, Any}
+
+
+class _Validate:
+    """A field that has to be validated, as if assigned to its model."""
+
+    def __init__(self, cls: type[BaseModel], name: str):
+        self.cls = cls
+        self.name = name
+
+    def __call__(self, model: BaseModel, value):
+        # Validated on a copy, since assignment validation updates the model
+        scratch = model.model_copy()
+        self.cls.__pydantic_validator__.validate_assignment(scratch, self.name, value)
+        return scratch.__dict__[self.name]
+
+
+def _is_plain(annotation) -> bool:
+    if annotation in _PLAIN_TYPES:
+        return True
+
+    origin = get_origin(annotation)
+    if origin in (dict, list, Union, UnionType):
+        return all(_is_plain(arg) for arg in get_args(annotation))
+
+    return False
+
+
+def _model_type(annotation) -> type[BaseModel] | None:
+    """The model class of a ``Model`` or ``Model | None`` annotation."""
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return annotation
+
+    if get_origin(annotation) in (Union, UnionType):
+        args = [arg for arg in get_args(annotation) if arg is not NoneType]
+        if len(args) == 1:
+            return _model_type(args[0])
+
+    return None
+
+
+@lru_cache(maxsize=None)
+def _schema(cls: type[BaseModel]) -> dict[str, Any]:
+    """
+    How to restore each field of ``cls``: with the nested model class to
+    construct, `None` to take the value as it is, or a `_Validate`.
+    """
+    schema = {}
+    for name, field in cls.model_fields.items():
+        model = _model_type(field.annotation)
+        if model is not None:
+            schema[name] = model
+        elif _is_plain(field.annotation):
+            schema[name] = None
+        else:
+            schema[name] = _Validate(cls, name)
+    return schema
+
+
+def _value(kind, value, current=None):
+    # Fields to validate are dealt with by the callers, which have the model
+    if value is None:
+        return None
+    if kind is None:
+        return value
+    if isinstance(value, BaseModel):
+        return value
+    if isinstance(current, kind):
+        changes = _changes(current, value)
+        if not changes:
+            return current
+        # Like `model_copy(update=...)`, without that counting as a change
+        # for models that track them
+        copy = current.model_copy()
+        copy.__dict__.update(changes)
+        copy.__pydantic_fields_set__.update(changes)
+        return copy
+    return construct(kind, value)
+
+
+def construct(cls: type[BaseModel], data: dict) -> BaseModel:
+    """Builds a ``cls`` from trusted ``data`` without validating it. Fields
+    missing from ``data`` get their defaults; unknown keys are ignored."""
+    schema = _schema(cls)
+    model = cls.model_construct(
+        **{
+            name: _value(schema[name], value)
+            for name, value in data.items()
+            if name in schema and not isinstance(schema[name], _Validate)
+        }
+    )
+
+    validated = {
+        name: schema[name](model, value)
+        for name, value in data.items()
+        if isinstance(schema.get(name), _Validate) and value is not None
+    }
+    model.__dict__.update(validated)
+    model.__pydantic_fields_set__.update(validated)
+    return model
+
+
+def _changes(model: BaseModel, data: dict) -> dict:
+    schema = _schema(type(model))
+    changes = {}
+
+    for name, value in data.items():
+        if name not in schema:
+            continue
+
+        current = model.__dict__.get(name)
+        if isinstance(schema[name], _Validate) and value is not None:
+            new = schema[name](model, value)
+        else:
+            new = _value(schema[name], value, current)
+
+        if _differs(new, current):
+            changes[name] = new
+
+    return changes
+
+
+def _differs(new, current) -> bool:
+    if new is current:
+        return False
+    try:
+        return bool(new != current)
+    except (TypeError, ValueError):
+        # Values like arrays compare element-wise; treat them as changed
+        return True
+
+
+def hydrate(model: BaseModel, data: dict) -> set[str]:
+    """
+    Updates ``model`` in place from trusted ``data``, touching only the
+    fields whose values differ, and returns the names of those fields.
+    Fields missing from ``data`` are left alone, so ``data`` may be partial.
+    Nested models that change are replaced by updated copies rather than
+    modified, since they may be shared.
+    """
+    changes = _changes(model, data)
+    model.__dict__.update(changes)
+    model.__pydantic_fields_set__.update(changes)
+    return set(changes)
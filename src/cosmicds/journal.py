@@ -0,0 +1,119 @@
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+__all__ = ["StateJournal", "default_journal_path"]
+
+
+def default_journal_path() -> Path:
+    """
+    The journal location: ``$CDS_JOURNAL_PATH`` if set, and otherwise
+    ``journal.sqlite`` in ``$CDS_DATA_DIR`` (``~/.cosmicds`` by default).
+    """
+    if "CDS_JOURNAL_PATH" in os.environ:
+        return Path(os.environ["CDS_JOURNAL_PATH"])
+
+    data_dir = Path(os.getenv("CDS_DATA_DIR", Path.home() / ".cosmicds"))
+    return data_dir / "journal.sqlite"
+
+
+class StateJournal:
+    """
+    Durable, local write-ahead journal of state writes, backed by SQLite.
+
+    The journal keeps one entry per state path holding the latest body
+    written to it, and whether the server has acknowledged that body yet.
+    Entries that are still pending after a restart are replayed.
+
+    Each entry carries a sequence number that is bumped on every write, so
+    that acknowledging an older write never hides a newer one.
+    """
+
+    def __init__(self, path: str | os.PathLike | None = None):
+        path = Path(path) if path is not None else default_journal_path()
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # Survives a crash of the server process, without an fsync per write
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS writes (
+                path TEXT PRIMARY KEY,
+                body BLOB NOT NULL,
+                seq INTEGER NOT NULL,
+                pending INTEGER NOT NULL,
+                updated REAL NOT NULL
+            )
+            """
+        )
+
+    def record(self, path: str, body: bytes) -> int:
+        """Records a pending write of ``body`` to ``path``, and returns its
+        sequence number."""
+        with self._lock:
+            row = self._db.execute(
+                """
+                INSERT INTO writes (path, body, seq, pending, updated)
+                VALUES (?, ?, 1, 1, ?)
+                ON CONFLICT (path) DO UPDATE SET
+                    body = excluded.body,
+                    seq = seq + 1,
+                    pending = 1,
+                    updated = excluded.updated
+                RETURNING seq
+                """,
+                (path, body, time.time()),
+            ).fetchone()
+        return row[0]
+
+    def ack(self, path: str, seq: int):
+        """Marks the write with sequence number ``seq`` to ``path`` as
+        acknowledged, unless a newer write has been recorded since."""
+        with self._lock:
+            self._db.execute(
+                "UPDATE writes SET pending = 0 WHERE path = ? AND seq = ?",
+                (path, seq),
+            )
+
+    def forget(self, path: str):
+        """Removes the entry for ``path``, acknowledged or not."""
+        with self._lock:
+            self._db.execute("DELETE FROM writes WHERE path = ?", (path,))
+
+    def pending_seq(self, path: str) -> int | None:
+        """The sequence number of the unacknowledged write to ``path``, if
+        there is one."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT seq FROM writes WHERE path = ? AND pending = 1", (path,)
+            ).fetchone()
+        return row[0] if row is not None else None
+
+    def pending(self) -> list[tuple[str, bytes, int]]:
+        """Returns the ``(path, body, seq)`` of every unacknowledged write,
+        oldest first."""
+        with self._lock:
+            return self._db.execute(
+                "SELECT path, body, seq FROM writes WHERE pending = 1 ORDER BY updated"
+            ).fetchall()
+
+    def latest(self, path: str, pending_only: bool = False) -> bytes | None:
+        """Returns the last body written to ``path``, if any. If
+        ``pending_only`` is True, only an unacknowledged body is returned."""
+        query = "SELECT body FROM writes WHERE path = ?"
+        if pending_only:
+            query += " AND pending = 1"
+
+        with self._lock:
+            row = self._db.execute(query, (path,)).fetchone()
+        return row[0] if row is not None else None
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -12,12 +12,15 @@ from solara.server import settings
 from solara.toestand import Ref
 from solara_enterprise import auth
 from solara import Reactive
+from glue.core import HubListener
 
 
+from .messages import WriteToDatabaseMessage
+from .prefetch import get_prefetcher
 from .state import GLOBAL_STATE, BaseLocalState, Speech
 from .remote import BASE_API
 from cosmicds import load_custom_vue_components
-from cosmicds.utils import get_session_id
+from cosmicds.utils import get_kernel_id, get_session_id
 from cosmicds.components.login import Login
 from cosmicds.components.speech_settings import SpeechSettings
 from cosmicds.logger import setup_logger
@@ -30,6 +33,19 @@ if "AWS_EBS_URL" in os.environ:
 logger = setup_logger("LAYOUT")
 
 
+# The `(hashed_user, story_name)` each kernel has bootstrapped, dropped when
+# the kernel shuts down
+_BOOTSTRAPPED: dict[str | None, tuple[str, str]] = {}
+
+
+def _on_session_start():
+    kernel_id = get_kernel_id()
+    return lambda: _BOOTSTRAPPED.pop(kernel_id, None)
+
+
+solara.lab.on_kernel_start(_on_session_start)
+
+
 @solara.component
 def BaseLayout(
     local_state: Optional[Reactive[BaseLocalState]] = None,
@@ -48,6 +64,23 @@ def BaseLayout(
 
     selected_link.subscribe_change(on_selected_link_change)
 
+    # Send any state writes still queued for the previous route
+    solara.use_effect(lambda: BASE_API.flush_writes(), [route_index])
+
+    prefetcher = get_prefetcher()
+
+    def _subscribe_to_messages():
+        hub = GLOBAL_STATE.value.glue_session.hub
+        listener = HubListener()
+        hub.subscribe(
+            listener,
+            WriteToDatabaseMessage,
+            handler=lambda _message: BASE_API.flush_writes(),
+        )
+        return lambda: hub.unsubscribe_all(listener)
+
+    solara.use_effect(_subscribe_to_messages, [])
+
     active = solara.use_reactive(False)
     class_code = solara.use_reactive("")
     update_db = solara.use_reactive(False)
@@ -98,22 +131,76 @@ def BaseLayout(
         )
         class_code.set("215")
 
-    if bool(auth.user.value):
-        if BASE_API.user_exists:
-            BASE_API.load_user_info(story_name, GLOBAL_STATE)
-        elif bool(class_code.value):
-            BASE_API.create_new_user(story_name, class_code.value, GLOBAL_STATE)
-        else:
-            logger.error("User is authenticated, but does not exist.")
-            solara.use_router().push(auth.get_logout_url())
-    else:
+    router = solara.use_router()
+    hashed_user = BASE_API.hashed_user if bool(auth.user.value) else None
+
+    def _bootstrap_user():
+        if hashed_user is None:
+            return None
+
+        # Only bootstrap once per kernel for a given user and story, even if
+        #  the layout is re-mounted (each tab has a kernel, and state, of its own)
+        kernel_id = get_kernel_id()
+        if _BOOTSTRAPPED.get(kernel_id) == (hashed_user, story_name):
+            return True
+
+        exists = BASE_API.bootstrap_user(story_name, class_code.value, GLOBAL_STATE)
+
+        if exists:
+            _BOOTSTRAPPED[kernel_id] = (hashed_user, story_name)
+
+        return exists
+
+    # Failures are shown below, with a way to retry, rather than raised
+    bootstrap = solara.lab.use_task(
+        _bootstrap_user, dependencies=[hashed_user, story_name], raise_error=False
+    )
+
+    def _prefetch_next_route():
+        # Routes opt in by naming their stage, as in `Route(..., data={"stage_id": ...})`
+        if (
+            local_state is None
+            or not (bootstrap.finished and bootstrap.value)
+            or not GLOBAL_STATE.value.update_db
+            or route_index + 1 >= len(routes_current_level)
+        ):
+            return
+
+        data = routes_current_level[route_index + 1].data
+        if not isinstance(data, dict) or data.get("stage_id") is None:
+            return
+
+        prefetcher.prefetch_stage_state(
+            GLOBAL_STATE.value.student.id,
+            local_state.value.story_id,
+            data["stage_id"],
+        )
+
+    solara.use_effect(_prefetch_next_route, [route_index, bootstrap.finished])
+
+    def _watch_class_size():
+        if not (bootstrap.finished and bootstrap.value) or not GLOBAL_STATE.value.update_db:
+            return
+        return BASE_API.watch_class_size(GLOBAL_STATE)
+
+    solara.use_effect(_watch_class_size, [bootstrap.finished])
+    solara.use_effect(lambda: prefetcher.cancel, [])
+
+    if hashed_user is None:
         logger.info("User has not authenticated.")
         BASE_API.clear_user(GLOBAL_STATE)
+        _BOOTSTRAPPED.pop(get_kernel_id(), None)
 
         login_dialog = Login(active, class_code, update_db, debug_mode)
         active.set(True)
         return
 
+    if bootstrap.finished and bootstrap.value is False:
+        logger.error("User is authenticated, but does not exist.")
+        router.push(auth.get_logout_url())
+    elif bootstrap.error:
+        logger.error("Failed to load user info: %s", bootstrap.exception)
+
     # Just for testing
     # Ref(GLOBAL_STATE.fields.student.id).set(0)
     # Ref(GLOBAL_STATE.fields.classroom.class_info).set({"id": 0})
@@ -188,7 +275,7 @@ def BaseLayout(
                             dense=True,
                         )
                         rv.TextField(
-                            value=f"{BASE_API.hashed_user}",
+                            value=f"{hashed_user}",
                             label="Student Hash",
                             readonly=True,
                             outlined=True,
@@ -303,9 +390,40 @@ def BaseLayout(
                 style_="height: 100%; width: 100%; overflow: auto;",
                 fluid=True,
             ):
-                rv.Container(
-                    children=children, style_="height: 100%; width: 100%", fluid=False
-                )
+                if bootstrap.finished and bootstrap.value:
+                    rv.Container(
+                        children=children,
+                        style_="height: 100%; width: 100%",
+                        fluid=False,
+                    )
+                elif bootstrap.error:
+                    with rv.Container(
+                        class_="d-flex flex-column align-center justify-center",
+                        style_="height: 100%; width: 100%",
+                    ):
+                        rv.Alert(
+                            type="error",
+                            outlined=True,
+                            children=[
+                                "We couldn't load your information. "
+                                "Please check your connection and try again."
+                            ],
+                        )
+                        solara.Button(
+                            "Try again",
+                            color="primary",
+                            on_click=lambda: bootstrap(),
+                        )
+                else:
+                    with rv.Container(
+                        class_="d-flex align-center justify-center",
+                        style_="height: 100%; width: 100%",
+                    ):
+                        rv.ProgressCircular(
+                            indeterminate=True,
+                            size=64,
+                            color="primary",
+                        )
 
         with rv.Footer(
             class_="text-center align-items",
@@ -0,0 +1,235 @@
+"""
+Classroom load driver for the CosmicDS API client.
+
+Simulates a number of concurrent student sessions logging in, loading their
+story and stage states, writing stage states and revisiting stages, and
+reports latency percentiles for each operation along with the overall request
+rate. By default this runs against an in-process `cosmicds.stand_in.StandInAPI`:
+
+    python -m cosmicds.loadtest --sessions 30 --latency 0.05 --jitter 0.05
+"""
+
+import argparse
+import asyncio
+import hashlib
+import time
+from collections import Counter, defaultdict
+from contextlib import asynccontextmanager
+
+from .metrics import APIMetrics
+from .remote import APIClient, AsyncBaseAPI
+from .stand_in import StandInAPI
+from .utils import percentile_index
+
+__all__ = ["LatencyRecorder", "run_load"]
+
+
+class LatencyRecorder:
+    """Records the duration and failures of each named operation."""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = Counter()
+
+    @asynccontextmanager
+    async def measure(self, operation: str):
+        """
+        Times the enclosed block as one sample of ``operation``. Exceptions
+        raised in the block are counted as errors and suppressed.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.errors[operation] += 1
+        finally:
+            self.samples[operation].append(time.perf_counter() - start)
+
+    def summary(self) -> dict:
+        summary = {}
+        for operation, samples in self.samples.items():
+            ordered = sorted(samples)
+            summary[operation] = {
+                "count": len(ordered),
+                "errors": self.errors[operation],
+                **{
+                    f"p{percent}": ordered[percentile_index(len(ordered), percent)]
+                    for percent in (50, 95, 99)
+                },
+            }
+        return summary
+
+
+async def run_session(
+    api: AsyncBaseAPI,
+    recorder: LatencyRecorder,
+    index: int,
+    story: str,
+    stages: list[str],
+    writes_per_stage: int,
+    think_time: float,
+    class_code: str,
+):
+    """Runs one simulated student session."""
+    hashed_user = hashlib.sha1(f"cosmicds-loadtest-{index}".encode()).hexdigest()
+    user_info = None
+
+    async with recorder.measure("login"):
+        user_info = await api.load_user_info(hashed_user, story)
+        if user_info is None:
+            await api.create_student(hashed_user, class_code)
+            user_info = await api.load_user_info(hashed_user, story)
+        if user_info is None:
+            raise RuntimeError(f"Session {index} could not log in.")
+
+    if user_info is None:
+        return
+
+    sid = user_info[0]["id"]
+
+    async with recorder.measure("story-state"):
+        await api.get_story_state(sid, story)
+
+    for stage in stages:
+        async with recorder.measure("stage-state"):
+            await api.get_stage_state(sid, story, stage)
+
+        for step in range(writes_per_stage):
+            api.put_stage_state(
+                sid, story, stage, {"stage_id": stage, "step": step}, owner=hashed_user
+            )
+            await asyncio.sleep(think_time)
+
+        async with recorder.measure("stage-write"):
+            if not await api.flush_writes(hashed_user):
+                raise RuntimeError(f"Session {index} failed to write stage `{stage}`.")
+
+    # Going back over the stages should only revalidate them
+    for stage in stages:
+        async with recorder.measure("stage-revisit"):
+            await api.get_stage_state(sid, story, stage)
+
+
+async def run_load(
+    sessions: int = 30,
+    story: str = "hubbles_law",
+    stages: list[str] = ("1", "2", "3"),
+    writes_per_stage: int = 5,
+    think_time: float = 0.01,
+    class_code: str = "0",
+    api_url: str | None = None,
+    stand_in: StandInAPI | None = None,
+) -> dict:
+    """
+    Runs ``sessions`` concurrent student sessions and returns a report of
+    per-operation latencies, along with the total request count and rate.
+
+    Requests go to ``api_url`` if it is given, and otherwise to ``stand_in``
+    (or a default `StandInAPI`) in-process.
+    """
+    metrics = APIMetrics()
+    if api_url is None:
+        stand_in = stand_in or StandInAPI()
+        client = APIClient(transport=stand_in.transport)
+        api = AsyncBaseAPI(client=client, api_url="http://stand-in", metrics=metrics)
+    else:
+        client = APIClient()
+        api = AsyncBaseAPI(client=client, api_url=api_url, metrics=metrics)
+
+    # Writes made here must never be replayed against a real server later
+    api.JOURNAL = False
+
+    recorder = LatencyRecorder()
+    start = time.perf_counter()
+
+    try:
+        await asyncio.gather(
+            *(
+                run_session(
+                    api,
+                    recorder,
+                    index,
+                    story,
+                    list(stages),
+                    writes_per_stage,
+                    think_time,
+                    class_code,
+                )
+                for index in range(sessions)
+            )
+        )
+    finally:
+        elapsed = time.perf_counter() - start
+        await asyncio.to_thread(client.close)
+
+    if stand_in is not None:
+        requests = sum(stand_in.requests.values())
+    else:
+        # Every response we got, whatever its status
+        requests = sum(metrics.responses.values())
+
+    return {
+        "sessions": sessions,
+        "elapsed": elapsed,
+        "requests": requests,
+        "requests_per_second": requests / elapsed if elapsed else 0.0,
+        "operations": recorder.summary(),
+        "bytes_sent": sum(metrics.bytes_sent.values()),
+        "bytes_received": sum(metrics.bytes_received.values()),
+    }
+
+
+def format_report(report: dict) -> str:
+    lines = [
+        f"{report['sessions']} sessions, {report['requests']} requests in "
+        f"{report['elapsed']:.2f}s ({report['requests_per_second']:.1f} req/s), "
+        f"{report['bytes_sent']} bytes sent, {report['bytes_received']} received",
+        "",
+        f"{'operation':<14}{'count':>7}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}",
+    ]
+    for operation, stats in report["operations"].items():
+        lines.append(
+            f"{operation:<14}{stats['count']:>7}{stats['errors']:>8}"
+            f"{stats['p50'] * 1000:>10.1f}{stats['p95'] * 1000:>10.1f}"
+            f"{stats['p99'] * 1000:>10.1f}"
+        )
+    return "\n".join(lines)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Simulate classroom load on the CosmicDS API.")
+    parser.add_argument("--sessions", type=int, default=30)
+    parser.add_argument("--stages", type=int, default=3)
+    parser.add_argument("--writes-per-stage", type=int, default=5)
+    parser.add_argument("--think-time", type=float, default=0.01)
+    parser.add_argument("--url", default=None, help="Run against this server instead of an in-process stand-in.")
+    parser.add_argument("--class-code", default="0")
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    options = parser.parse_args(args)
+
+    stand_in = None
+    if options.url is None:
+        stand_in = StandInAPI(
+            latency=options.latency,
+            jitter=options.jitter,
+            error_rate=options.error_rate,
+        )
+
+    report = asyncio.run(
+        run_load(
+            sessions=options.sessions,
+            stages=[str(stage) for stage in range(1, options.stages + 1)],
+            writes_per_stage=options.writes_per_stage,
+            think_time=options.think_time,
+            class_code=options.class_code,
+            api_url=options.url,
+            stand_in=stand_in,
+        )
+    )
+    print(format_report(report))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+"""
+Server-side metrics for requests made to the CosmicDS API.
+
+`APIMetrics` keeps per-endpoint latency histograms, response status counts,
+bytes sent and received, and the number of requests in flight. Read them
+with `APIMetrics.snapshot`, or in the Prometheus text format with
+`APIMetrics.prometheus`. Setting ``CDS_METRICS_PORT`` serves the latter on
+``http://127.0.0.1:$CDS_METRICS_PORT/metrics`` (see `start_metrics_server`).
+"""
+
+import asyncio
+import bisect
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Awaitable, Callable
+
+import httpx
+
+__all__ = ["APIMetrics", "Histogram", "start_metrics_server"]
+
+# Upper bounds, in seconds, of the latency histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Histogram of observations, with fixed buckets."""
+
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        # One count per bucket, plus one for observations above the last
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> list[tuple[float, int]]:
+        """The ``(upper bound, count)`` of each bucket, counting every
+        observation at or below the bound, ending with infinity."""
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class APIMetrics:
+    """
+    Request metrics, labelled by endpoint name and method. Requests are
+    recorded from the API client loop; everything else is safe to call from
+    any thread.
+
+    Parameters
+    ----------
+    buckets : tuple of float
+        Upper bounds, in seconds, of the latency histogram buckets.
+    """
+
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self._buckets = buckets
+        self._lock = threading.Lock()
+        self.latencies: dict[tuple[str, str], Histogram] = {}
+        self.responses = Counter()
+        self.bytes_sent = Counter()
+        self.bytes_received = Counter()
+        self.in_flight = Counter()
+
+    async def observe(
+        self, endpoint: str, method: str, request: Awaitable[httpx.Response]
+    ) -> httpx.Response:
+        """Awaits ``request``, recording its latency, outcome and size."""
+        with self._lock:
+            self.in_flight[endpoint] += 1
+
+        start = time.perf_counter()
+        status = "error"
+        response = None
+
+        try:
+            response = await request
+            status = str(response.status_code)
+            return response
+        except asyncio.CancelledError:
+            # Such as hedge requests that lose the race
+            status = "cancelled"
+            raise
+        finally:
+            latency = time.perf_counter() - start
+
+            with self._lock:
+                self.in_flight[endpoint] -= 1
+                self.responses[endpoint, method, status] += 1
+
+                if response is not None:
+                    key = (endpoint, method)
+                    if key not in self.latencies:
+                        self.latencies[key] = Histogram(self._buckets)
+                    self.latencies[key].observe(latency)
+
+                    self.bytes_sent[endpoint] += _request_size(response.request)
+                    self.bytes_received[endpoint] += response.num_bytes_downloaded
+
+    def reset(self):
+        with self._lock:
+            self.latencies.clear()
+            self.responses.clear()
+            self.bytes_sent.clear()
+            self.bytes_received.clear()
+
+    def snapshot(self) -> dict:
+        """The current metrics, as plain data."""
+        with self._lock:
+            return {
+                "latency": {
+                    f"{method} {endpoint}": {
+                        "count": histogram.count,
+                        "sum": histogram.sum,
+                        "mean": histogram.sum / histogram.count if histogram.count else 0.0,
+                        "buckets": histogram.cumulative(),
+                    }
+                    for (endpoint, method), histogram in self.latencies.items()
+                },
+                "responses": {
+                    f"{method} {endpoint} {status}": count
+                    for (endpoint, method, status), count in self.responses.items()
+                },
+                "bytes_sent": dict(self.bytes_sent),
+                "bytes_received": dict(self.bytes_received),
+                "in_flight": {
+                    endpoint: count for endpoint, count in self.in_flight.items() if count
+                },
+            }
+
+    def prometheus(self, policy: dict | None = None) -> str:
+        """
+        The current metrics in the Prometheus text exposition format. If
+        ``policy`` is given, it should be a `RequestPolicy.snapshot`, whose
+        retry, hedge and circuit breaker figures are included too.
+        """
+        lines = []
+
+        def family(name, kind, help):
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            family(
+                "cosmicds_api_request_duration_seconds",
+                "histogram",
+                "Latency of requests to the CosmicDS API.",
+            )
+            for (endpoint, method), histogram in sorted(self.latencies.items()):
+                labels = f'endpoint="{endpoint}",method="{method}"'
+                for bound, count in histogram.cumulative():
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(
+                        f'cosmicds_api_request_duration_seconds_bucket{{{labels},le="{le}"}} {count}'
+                    )
+                lines.append(f"cosmicds_api_request_duration_seconds_sum{{{labels}}} {histogram.sum}")
+                lines.append(f"cosmicds_api_request_duration_seconds_count{{{labels}}} {histogram.count}")
+
+            family(
+                "cosmicds_api_responses_total",
+                "counter",
+                "Requests to the CosmicDS API by response status.",
+            )
+            for (endpoint, method, status), count in sorted(self.responses.items()):
+                lines.append(
+                    f'cosmicds_api_responses_total{{endpoint="{endpoint}",method="{method}",status="{status}"}} {count}'
+                )
+
+            for name, counter, help in (
+                ("cosmicds_api_sent_bytes_total", self.bytes_sent, "Bytes sent in request bodies."),
+                ("cosmicds_api_received_bytes_total", self.bytes_received, "Bytes received in response bodies."),
+            ):
+                family(name, "counter", help)
+                for endpoint, count in sorted(counter.items()):
+                    lines.append(f'{name}{{endpoint="{endpoint}"}} {count}')
+
+            family(
+                "cosmicds_api_in_flight_requests",
+                "gauge",
+                "Requests to the CosmicDS API awaiting a response.",
+            )
+            for endpoint, count in sorted(self.in_flight.items()):
+                lines.append(f'cosmicds_api_in_flight_requests{{endpoint="{endpoint}"}} {count}')
+
+        if policy is not None:
+            family("cosmicds_api_retries_total", "counter", "Requests retried.")
+            lines.append(f"cosmicds_api_retries_total {policy['retries']}")
+            family("cosmicds_api_hedges_total", "counter", "Hedge requests sent.")
+            lines.append(f"cosmicds_api_hedges_total {policy['hedges']}")
+
+            family(
+                "cosmicds_api_circuit_open",
+                "gauge",
+                "Whether each endpoint's circuit is open (1) or half-open (0.5).",
+            )
+            for endpoint, breaker in sorted(policy["breakers"].items()):
+                value = {"open": 1, "half-open": 0.5}.get(breaker["state"], 0)
+                lines.append(f'cosmicds_api_circuit_open{{endpoint="{endpoint}"}} {value}')
+
+            family(
+                "cosmicds_api_circuit_opened_total",
+                "counter",
+                "Times each endpoint's circuit has opened.",
+            )
+            for endpoint, breaker in sorted(policy["breakers"].items()):
+                lines.append(
+                    f'cosmicds_api_circuit_opened_total{{endpoint="{endpoint}"}} {breaker["times_opened"]}'
+                )
+
+        return "\n".join(lines) + "\n"
+
+
+def _request_size(request: httpx.Request) -> int:
+    try:
+        return len(request.content)
+    except httpx.RequestNotRead:
+        # Streamed bodies; we never send these, but don't fail if someone does
+        return int(request.headers.get("content-length", 0))
+
+
+def start_metrics_server(
+    port: int, collect: Callable[[], str], host: str = "127.0.0.1"
+) -> ThreadingHTTPServer:
+    """
+    Serves the text returned by ``collect`` at ``/metrics`` on a daemon
+    thread, for a Prometheus scraper. Returns the server, whose
+    ``shutdown`` method stops it.
+    """
+
+    class _Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+
+            body = collect().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), _Handler)
+    threading.Thread(
+        target=server.serve_forever, name="cosmicds-metrics", daemon=True
+    ).start()
+    return server
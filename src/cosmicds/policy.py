@@ -0,0 +1,278 @@
+import asyncio
+import random
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+
+import httpx
+
+from .utils import percentile_index
+
+__all__ = ["CircuitBreaker", "CircuitOpenError", "EndpointPolicy", "RequestPolicy"]
+
+# Methods that may safely be retried or hedged
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+# Response statuses worth retrying
+RETRY_STATUSES = {429, 502, 503, 504}
+
+
+class CircuitOpenError(httpx.RequestError):
+    """Raised instead of making a request while an endpoint's circuit is open."""
+
+
+@dataclass
+class EndpointPolicy:
+    """
+    How requests to one endpoint are made.
+
+    Attributes
+    ----------
+    timeout : float, optional
+        Per-request timeout in seconds. Uses the client's default if None.
+    retries : int
+        How many times to retry an idempotent request after a transport
+        error or a retryable status.
+    backoff : float
+        Base delay in seconds before the first retry; each further retry
+        doubles it. The actual delay is chosen at random up to that value.
+    max_backoff : float
+        Upper bound on the delay before any retry.
+    hedge_percentile : float, optional
+        If set, an idempotent request still running after this percentile of
+        the endpoint's recent latencies gets a duplicate request, and
+        whichever finishes first wins.
+    hedge_min_samples : int
+        How many latencies must have been seen before hedging starts.
+    failure_threshold : int
+        Consecutive failures after which the endpoint's circuit opens.
+    reset_timeout : float
+        Seconds an open circuit waits before letting a trial request through.
+    """
+
+    timeout: float | None = None
+    retries: int = 0
+    backoff: float = 0.2
+    max_backoff: float = 2.0
+    hedge_percentile: float | None = None
+    hedge_min_samples: int = 20
+    failure_threshold: int = 5
+    reset_timeout: float = 30.0
+
+
+class CircuitBreaker:
+    """
+    Tracks consecutive failures of an endpoint. Once ``failure_threshold``
+    is reached the circuit opens and requests fail fast; after
+    ``reset_timeout`` seconds one trial request is let through (half-open),
+    and its outcome closes or re-opens the circuit.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self.state = CircuitBreaker.CLOSED
+        self.failures = 0
+        self.times_opened = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+
+    def allow(self) -> bool:
+        if self.state == CircuitBreaker.OPEN:
+            if self._clock() - self._opened_at < self.reset_timeout:
+                return False
+            self.state = CircuitBreaker.HALF_OPEN
+
+        if self.state == CircuitBreaker.HALF_OPEN:
+            if self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+
+        return True
+
+    def record_success(self):
+        self.state = CircuitBreaker.CLOSED
+        self.failures = 0
+        self._trial_in_flight = False
+
+    def release(self):
+        """Gives up a request let through by `allow` without recording an
+        outcome (e.g. because it was cancelled), so that a half-open circuit
+        lets the next one through."""
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._trial_in_flight = False
+
+        if (
+            self.state == CircuitBreaker.HALF_OPEN
+            or self.failures >= self.failure_threshold
+        ):
+            if self.state != CircuitBreaker.OPEN:
+                self.times_opened += 1
+            self.state = CircuitBreaker.OPEN
+            self._opened_at = self._clock()
+
+
+class RequestPolicy:
+    """
+    Applies per-endpoint timeouts, retries, hedging and circuit breaking to
+    requests. Not thread-safe; use from the API client loop only.
+
+    Parameters
+    ----------
+    policies : dict
+        `EndpointPolicy` for each endpoint name.
+    default : `EndpointPolicy`
+        The policy for endpoints not in ``policies``.
+    window : int
+        How many recent latencies to keep per endpoint, for hedging.
+    """
+
+    def __init__(
+        self,
+        policies: dict[str, EndpointPolicy],
+        default: EndpointPolicy | None = None,
+        window: int = 200,
+    ):
+        self.policies = policies
+        self.default = default or EndpointPolicy()
+        self._window = window
+        self._breakers: dict[str, CircuitBreaker] = {}
+        self._latencies: dict[str, deque] = {}
+        self.hedges = 0
+        self.retries = 0
+
+    def for_endpoint(self, endpoint: str) -> EndpointPolicy:
+        return self.policies.get(endpoint, self.default)
+
+    def breaker(self, endpoint: str) -> CircuitBreaker:
+        if endpoint not in self._breakers:
+            policy = self.for_endpoint(endpoint)
+            self._breakers[endpoint] = CircuitBreaker(
+                policy.failure_threshold, policy.reset_timeout
+            )
+        return self._breakers[endpoint]
+
+    def _hedge_delay(self, endpoint: str, policy: EndpointPolicy) -> float | None:
+        latencies = self._latencies.get(endpoint)
+        if (
+            policy.hedge_percentile is None
+            or latencies is None
+            or len(latencies) < policy.hedge_min_samples
+        ):
+            return None
+
+        ordered = sorted(latencies)
+        return ordered[percentile_index(len(ordered), policy.hedge_percentile)]
+
+    def _record_latency(self, endpoint: str, latency: float):
+        self._latencies.setdefault(endpoint, deque(maxlen=self._window)).append(latency)
+
+    async def execute(
+        self,
+        endpoint: str,
+        method: str,
+        send: Callable[[float | None], Awaitable[httpx.Response]],
+    ) -> httpx.Response:
+        """
+        Makes a request through ``send``, which is called with the timeout
+        to use (None for the client default) and returns the response.
+        """
+        policy = self.for_endpoint(endpoint)
+        breaker = self.breaker(endpoint)
+        idempotent = method in IDEMPOTENT_METHODS
+        attempts = 1 + (policy.retries if idempotent else 0)
+
+        for attempt in range(attempts):
+            if not breaker.allow():
+                raise CircuitOpenError(f"Circuit for `{endpoint}` is open.")
+
+            start = time.perf_counter()
+            try:
+                if idempotent:
+                    response = await self._hedged(endpoint, policy, send)
+                else:
+                    response = await send(policy.timeout)
+            except httpx.TransportError:
+                breaker.record_failure()
+                if attempt == attempts - 1:
+                    raise
+            except BaseException:
+                # Cancelled, or failed in a way that says nothing about the
+                # endpoint's health
+                breaker.release()
+                raise
+            else:
+                if response.is_server_error:
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+                    self._record_latency(endpoint, time.perf_counter() - start)
+
+                if response.status_code not in RETRY_STATUSES or attempt == attempts - 1:
+                    return response
+
+            self.retries += 1
+            delay = min(policy.max_backoff, policy.backoff * 2**attempt)
+            await asyncio.sleep(random.uniform(0, delay))
+
+    async def _hedged(self, endpoint, policy, send) -> httpx.Response:
+        delay = self._hedge_delay(endpoint, policy)
+        if delay is None:
+            return await send(policy.timeout)
+
+        first = asyncio.ensure_future(send(policy.timeout))
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        if done:
+            return first.result()
+
+        self.hedges += 1
+        second = asyncio.ensure_future(send(policy.timeout))
+        pending = {first, second}
+        error = None
+
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def snapshot(self) -> dict:
+        """
+        The circuit breaker state of each endpoint seen so far, along with
+        overall retry and hedge counts. Safe to call from any thread.
+        """
+        return {
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "breakers": {
+                endpoint: {
+                    "state": breaker.state,
+                    "consecutive_failures": breaker.failures,
+                    "times_opened": breaker.times_opened,
+                }
+                # Copy first, since the loop may add breakers meanwhile
+                for endpoint, breaker in list(self._breakers.items())
+            },
+        }
@@ -0,0 +1,87 @@
+import threading
+
+import solara
+
+from .logger import setup_logger
+from .remote import BASE_API, BaseAPI
+from .utils import get_kernel_id
+
+__all__ = ["Prefetcher", "get_prefetcher"]
+
+logger = setup_logger("PREFETCH")
+
+
+class Prefetcher:
+    """
+    Loads the state of the stage the student will move to next in the
+    background, and hands it to `BaseAPI.get_stage_state` through the API's
+    per-session preload store.
+    """
+
+    def __init__(self, api: BaseAPI, owner: str | None):
+        self._api = api
+        self._owner = owner
+        self._lock = threading.Lock()
+        self._stage_path = None
+        self._stage_future = None
+
+    def prefetch_stage_state(self, sid: int, story_id: str, stage_id: str):
+        """
+        Starts loading the state of the given stage, cancelling the prefetch
+        of any other stage that is still in flight.
+        """
+        path = self._api.aio.stage_state_path(sid, story_id, stage_id)
+
+        with self._lock:
+            if path == self._stage_path and not self._stage_future.done():
+                return
+
+            self._cancel_stage()
+            self._stage_path = path
+            self._stage_future = self._api.aio.client.submit(
+                self._fetch_stage_state(path, sid, story_id, stage_id)
+            )
+
+    async def _fetch_stage_state(self, path, sid, story_id, stage_id):
+        state = await self._api.aio.get_stage_state(sid, story_id, stage_id)
+        if state is not None:
+            self._api._preload(path, state, owner=self._owner)
+
+    def _cancel_stage(self):
+        if self._stage_future is not None:
+            self._stage_future.cancel()
+        self._stage_path = None
+        self._stage_future = None
+
+    def cancel(self):
+        """Cancels any prefetch still in flight."""
+        with self._lock:
+            self._cancel_stage()
+
+
+_PREFETCHERS: dict[str | None, Prefetcher] = {}
+_PREFETCHERS_LOCK = threading.Lock()
+
+
+def get_prefetcher() -> Prefetcher:
+    """Returns the `Prefetcher` for the current session."""
+    owner = get_kernel_id()
+    with _PREFETCHERS_LOCK:
+        if owner not in _PREFETCHERS:
+            _PREFETCHERS[owner] = Prefetcher(BASE_API, owner)
+        return _PREFETCHERS[owner]
+
+
+def _on_session_start():
+    owner = get_kernel_id()
+
+    def cleanup():
+        with _PREFETCHERS_LOCK:
+            prefetcher = _PREFETCHERS.pop(owner, None)
+        if prefetcher is not None:
+            prefetcher.cancel()
+
+    return cleanup
+
+
+solara.lab.on_kernel_start(_on_session_start)
@@ -1,36 +1,1339 @@
 from solara_enterprise import auth
+import asyncio
+import atexit
 import hashlib
+import importlib.util
+import json
+import math
 import os
+import random
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from copy import deepcopy
+from dataclasses import dataclass
 from requests import Session
 from functools import cached_property
+from typing import Callable
 
+import httpx
+
+from . import delta
+from .cache import ResponseCache
+from .class_size import ClassSizeService
+from .hydration import hydrate
+from .journal import StateJournal
+from .metrics import APIMetrics, start_metrics_server
+from .policy import EndpointPolicy, RequestPolicy
+from .serialization import (
+    JSON_CONTENT_TYPE,
+    Codec,
+    codec_for_body,
+    codec_for_content_type,
+    compress,
+    get_codec,
+    get_compression,
+)
 from .state import GLOBAL_STATE, BaseLocalState, BaseState, GlobalState, Student
+from .utils import get_kernel_context, get_kernel_id
+import solara
 from solara import Reactive
 from solara.lab import Ref
 from cosmicds.logger import setup_logger
 
 logger = setup_logger("API")
 
+# Upper bounds on the shared connection pool. Every session multiplexes over
+# these connections instead of opening its own.
+DEFAULT_LIMITS = httpx.Limits(
+    max_connections=20, max_keepalive_connections=10, keepalive_expiry=30.0
+)
+
+# Default per-call timeouts (in seconds); individual calls may override these.
+DEFAULT_TIMEOUT = httpx.Timeout(10.0, connect=5.0)
+
+# HTTP/2 support in httpx requires the optional `h2` package
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+# Returned in place of a state document that hasn't changed since the copy
+# the caller already has (see `AsyncBaseAPI.get_state_document`)
+NOT_MODIFIED = object()
+
+
+class APIClient:
+    """
+    Owns the process-wide `httpx.AsyncClient` used to talk to the CosmicDS
+    API server, and the event loop that client runs on.
+
+    The loop runs on a dedicated daemon thread, so requests never execute on
+    a Solara render or event-handler thread, and all sessions in the process
+    share the same pool of warm (HTTP/2 keep-alive, where available)
+    connections.
+    """
+
+    def __init__(
+        self,
+        timeout: httpx.Timeout = DEFAULT_TIMEOUT,
+        limits: httpx.Limits = DEFAULT_LIMITS,
+        http2: bool | None = None,
+        transport: httpx.AsyncBaseTransport | None = None,
+    ):
+        self.timeout = timeout
+        self.limits = limits
+        self.http2 = HTTP2_AVAILABLE if http2 is None else http2
+        self._transport = transport
+        self._loop = None
+        self._http = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """The event loop on which all requests are made, started lazily."""
+        if self._loop is None:
+            with self._lock:
+                if self._loop is None:
+                    loop = asyncio.new_event_loop()
+                    threading.Thread(
+                        target=loop.run_forever, name="cosmicds-api", daemon=True
+                    ).start()
+                    self._loop = loop
+        return self._loop
+
+    @property
+    def http(self) -> httpx.AsyncClient:
+        """
+        The shared `httpx.AsyncClient`. This must only be used from coroutines
+        running on `loop`.
+        """
+        if self._http is None:
+            headers = {}
+            if os.getenv("CDS_API_KEY"):
+                headers["Authorization"] = os.getenv("CDS_API_KEY")
+
+            self._http = httpx.AsyncClient(
+                headers=headers,
+                timeout=self.timeout,
+                limits=self.limits,
+                http2=self.http2,
+                transport=self._transport,
+            )
+        return self._http
+
+    def on_loop(self) -> bool:
+        try:
+            return asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            return False
+
+    def submit(self, coro) -> Future:
+        """Schedule ``coro`` on the client loop from any thread."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro):
+        """Run ``coro`` on the client loop and block the calling thread for
+        its result. Must not be called from the client loop itself."""
+        if self.on_loop():
+            raise RuntimeError("Cannot block on the API client loop.")
+        return self.submit(coro).result()
+
+    async def call(self, coro):
+        """Await ``coro`` on the client loop from whichever loop we are on."""
+        if self.on_loop():
+            return await coro
+        return await asyncio.wrap_future(self.submit(coro))
+
+    def close(self):
+        if self._loop is None:
+            return
+        if self._http is not None:
+            self.run(self._http.aclose())
+            self._http = None
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._loop = None
+
+
+_DEFAULT_CLIENT = None
+_DEFAULT_CLIENT_LOCK = threading.Lock()
+
+
+def default_client() -> APIClient:
+    """Returns the process-wide `APIClient`, creating it on first use."""
+    global _DEFAULT_CLIENT
+    if _DEFAULT_CLIENT is None:
+        with _DEFAULT_CLIENT_LOCK:
+            if _DEFAULT_CLIENT is None:
+                _DEFAULT_CLIENT = APIClient()
+                atexit.register(_DEFAULT_CLIENT.close)
+    return _DEFAULT_CLIENT
+
+
+@dataclass
+class _PendingWrite:
+    body: bytes
+    owner: str | None
+    first_queued: float
+    timer: asyncio.TimerHandle | None = None
+    # Resolves to the write's journal sequence number, once it is recorded
+    seq: asyncio.Future | None = None
+    # Failed attempts so far, and the loop time before which not to retry
+    attempts: int = 0
+    not_before: float = 0.0
+
+
+# Outcomes of sending a queued write
+_SENT = "sent"
+_RETRY = "retry"
+_REJECTED = "rejected"
+
+# Client errors that may succeed if the same write is sent again later
+RETRYABLE_CLIENT_ERRORS = {408, 425, 429}
+
+
+class WriteBehindQueue:
+    """
+    Coalescing write-behind queue for state documents.
+
+    Only the latest body for each path is kept, so a burst of updates to the
+    same (student, story, stage) document results in a single write. A path
+    is written once it has gone ``delay`` seconds without a new update (and
+    at most ``max_delay`` seconds after its first pending update), or when
+    the queue is flushed.
+
+    Writes that fail are retried with jittered exponential backoff until
+    the server accepts them, unless it rejects them outright (with a 4xx
+    status that retrying won't change), in which case they are dropped.
+    If a `StateJournal` is given, each write is recorded there before it is
+    sent, and failed writes are left in the journal and replayed from it in
+    the background instead. Journal calls block, so they are made on a
+    thread of their own rather than on the loop.
+
+    Writes to the same path are sent one at a time, in the order they were
+    made, so an older body (e.g. one being replayed) never lands after a
+    newer one.
+
+    `enqueue`, `flush` and `close` may be called from any thread; everything
+    else runs on the API client loop.
+    """
+
+    # Initial and maximum delay (in seconds) between attempts to send a write
+    RETRY_BACKOFF = 1.0
+    RETRY_MAX_BACKOFF = 60.0
+
+    def __init__(
+        self,
+        api: "AsyncBaseAPI",
+        delay: float = 2.0,
+        max_delay: float = 10.0,
+        journal: StateJournal | None = None,
+    ):
+        self._api = api
+        self.delay = delay
+        self.max_delay = max_delay
+        self.journal = journal
+        self._pending: dict[str, _PendingWrite] = {}
+        # The last send started for each path, which the next one waits on
+        self._sending: dict[str, asyncio.Future] = {}
+        self._replay_needed = None
+        self._replay_task = None
+        self._closed = False
+
+        if journal is not None:
+            # A single thread, so that journal calls are made in order
+            self._journal_thread = ThreadPoolExecutor(1, thread_name_prefix="cds-journal")
+            self._loop.call_soon_threadsafe(self._start_replay)
+
+    @property
+    def _loop(self) -> asyncio.AbstractEventLoop:
+        return self._api.client.loop
+
+    def enqueue(self, path: str, body: bytes, owner: str | None = None):
+        """
+        Queues a write of ``body`` to ``path``, replacing any write to the
+        same path that has not been sent yet. ``owner`` identifies the session
+        the write belongs to, so that it can be flushed on its own.
+        """
+        loop = self._loop
+        write = _PendingWrite(body, owner, loop.time())
+        loop.call_soon_threadsafe(self._accept, path, write)
+
+    def _url(self, path: str) -> str:
+        return f"{self._api.API_URL}{path}"
+
+    async def _journal_call(self, method: Callable, *args):
+        # Returns None if the call fails
+        try:
+            return await self._loop.run_in_executor(self._journal_thread, method, *args)
+        except sqlite3.Error as e:
+            logger.error("Journal call `%s` failed: %s", method.__name__, e)
+            return None
+
+    def _accept(self, path: str, write: _PendingWrite):
+        if self.journal is not None:
+            write.seq = asyncio.ensure_future(
+                self._journal_call(self.journal.record, self._url(path), write.body)
+            )
+
+        self._enqueue(path, write)
+
+    def _enqueue(self, path: str, write: _PendingWrite):
+        previous = self._pending.get(path)
+        if previous is not None:
+            previous.timer.cancel()
+            write.first_queued = previous.first_queued
+            write.attempts = previous.attempts
+            write.not_before = previous.not_before
+
+        now = self._loop.time()
+        due = min(self.delay, write.first_queued + self.max_delay - now)
+        due = max(due, write.not_before - now, 0)
+        write.timer = self._loop.call_later(due, self._schedule, path)
+        self._pending[path] = write
+
+    def pending(self, path: str) -> bytes | None:
+        """Returns the unsent body queued for ``path``, if any."""
+        write = self._pending.get(path)
+        return write.body if write is not None else None
+
+    async def journaled(self, path: str, pending_only: bool = False) -> bytes | None:
+        """Returns the last body journaled for ``path``, if any; see
+        `StateJournal.latest`. Runs on the API client loop."""
+        if self.journal is None:
+            return None
+        return await self._journal_call(self.journal.latest, self._url(path), pending_only)
+
+    async def discard(self, path: str):
+        """Drops any unsent write to ``path``, along with its journal entry,
+        so that it is never sent (e.g. because the document is being
+        deleted). Runs on the API client loop."""
+        write = self._pending.pop(path, None)
+        if write is not None:
+            write.timer.cancel()
+
+        if self.journal is not None:
+            await self._journal_call(self.journal.forget, self._url(path))
+
+    def _schedule(self, path: str):
+        asyncio.ensure_future(self._write(path))
+
+    async def _write(self, path: str) -> str | None:
+        write = self._pending.pop(path, None)
+        if write is None:
+            return None
+
+        write.timer.cancel()
+
+        outcome = await self._send(path, write.body)
+
+        if outcome != _RETRY:
+            await self._ack(path, write.seq)
+        elif self._replay_needed is not None:
+            logger.error("Failed to write `%s`; will replay from journal.", path)
+            self._replay_needed.set()
+        elif path not in self._pending:
+            # Retry later, unless a newer body has been queued in the meantime
+            write.attempts += 1
+            write.first_queued = self._loop.time()
+            write.not_before = write.first_queued + self._backoff(write.attempts)
+            logger.error("Failed to write `%s`; will retry.", path)
+            self._enqueue(path, write)
+
+        return outcome
+
+    def _backoff(self, attempts: int) -> float:
+        backoff = min(self.RETRY_BACKOFF * 2 ** (attempts - 1), self.RETRY_MAX_BACKOFF)
+        return backoff * random.uniform(0.5, 1.5)
+
+    async def _send(self, path: str, body: bytes) -> str:
+        previous = self._sending.get(path)
+        sent = self._loop.create_future()
+        self._sending[path] = sent
+
+        try:
+            if previous is not None:
+                await previous
+            return await self._send_now(path, body)
+        finally:
+            sent.set_result(None)
+            if self._sending.get(path) is sent:
+                del self._sending[path]
+
+    async def _send_now(self, path: str, body: bytes) -> str:
+        try:
+            await self._api._write_state(path, body)
+        except httpx.HTTPStatusError as e:
+            status = e.response.status_code
+            if 400 <= status < 500 and status not in RETRYABLE_CLIENT_ERRORS:
+                logger.error("Server rejected write to `%s` (%s); dropping it.", path, status)
+                return _REJECTED
+
+            logger.error("Failed to write `%s`: %s", path, e)
+            return _RETRY
+        except httpx.HTTPError as e:
+            logger.error("Failed to write `%s`: %s", path, e)
+            return _RETRY
+        except Exception:
+            logger.exception("Failed to write `%s`", path)
+            return _RETRY
+
+        return _SENT
+
+    async def _ack(self, path: str, seq: asyncio.Future | int | None):
+        if isinstance(seq, asyncio.Future):
+            seq = await seq
+
+        if self.journal is None or seq is None:
+            return
+
+        await self._journal_call(self.journal.ack, self._url(path), seq)
+
+    def _start_replay(self):
+        self._replay_needed = asyncio.Event()
+        # Writes may have been left over from a previous run
+        self._replay_needed.set()
+        self._replay_task = asyncio.ensure_future(self._replay())
+
+    async def _replay(self):
+        attempts = 1
+
+        while True:
+            await self._replay_needed.wait()
+            await asyncio.sleep(self._backoff(attempts))
+
+            try:
+                done = await self._replay_pending()
+            except Exception:
+                logger.exception("Failed to replay journaled writes")
+                done = False
+
+            attempts = 1 if done else attempts + 1
+
+    async def _replay_pending(self) -> bool:
+        # Returns whether every pending write was either accepted or rejected
+        # (and so needs no further replay)
+        pending = await self._journal_call(self.journal.pending)
+        if pending is None:
+            return False
+
+        # Writes still in the queue will be sent (and acknowledged) from
+        # there. Only replay writes made against this API server.
+        prefix = self._api.API_URL
+        entries = [
+            (url[len(prefix):], body, seq)
+            for url, body, seq in pending
+            if url.startswith(prefix) and url[len(prefix):] not in self._pending
+        ]
+
+        if not entries:
+            self._replay_needed.clear()
+            return True
+
+        for path, body, seq in entries:
+            # Skip writes superseded since the list was read: a newer body
+            # has been queued, or journaled (and maybe sent) already
+            if path in self._pending:
+                continue
+            if await self._journal_call(self.journal.pending_seq, self._url(path)) != seq:
+                continue
+
+            if await self._send(path, body) == _RETRY:
+                return False
+
+            await self._ack(path, seq)
+
+        return True
+
+    async def _flush(self, owner: str | None = None) -> bool:
+        # Whether every write flushed was sent, rather than left to retry
+        paths = [
+            path
+            for path, write in self._pending.items()
+            if owner is None or write.owner == owner
+        ]
+        outcomes = await asyncio.gather(*(self._write(path) for path in paths))
+        return _RETRY not in outcomes
+
+    def close(self):
+        """
+        Stops the queue: cancels pending timers and journal replay, and shuts
+        down the journal thread. Writes not yet sent stay in the journal, if
+        there is one, for the next run to replay. Must be called before the
+        API client is closed; later calls do nothing.
+        """
+        if self._closed:
+            return
+        self._closed = True
+
+        if self._api.client._loop is not None:
+            self._api.client.run(self._stop())
+
+        if self.journal is not None:
+            self._journal_thread.shutdown(wait=True)
+
+    async def _stop(self):
+        for write in self._pending.values():
+            write.timer.cancel()
+
+        if self._replay_task is not None:
+            self._replay_task.cancel()
+            await asyncio.gather(self._replay_task, return_exceptions=True)
+
+    def flush(self, owner: str | None = None, wait: bool = False):
+        """
+        Sends all pending writes now, or only those belonging to ``owner``
+        if it is given. Blocks until they are sent if ``wait`` is True.
+        """
+        future = self._api.client.submit(self._flush(owner))
+
+        if wait:
+            future.result()
+
+
+class AsyncBaseAPI:
+    """
+    Non-blocking interface to the CosmicDS API server.
+
+    Methods here take plain identifiers and return plain (JSON) data; they
+    never read or write Solara reactive state, since they may run outside of
+    any kernel context. `BaseAPI` wraps these for use with reactive state.
+    """
 
-class BaseAPI:
     API_URL = "https://api.cosmicds.cfa.harvard.edu"
 
+    # The endpoints we use, named by the leading parts of their paths
+    ENDPOINTS = (
+        "student",
+        "students/create",
+        "class-for-student-story",
+        "classes/size",
+        "stage-state",
+        "story-state",
+        "story-bootstrap",
+    )
+
+    # How requests to each endpoint are timed out, retried, hedged and
+    # circuit-broken; see `EndpointPolicy`. Only idempotent requests are ever
+    # retried or hedged.
+    POLICIES = {
+        "student": EndpointPolicy(timeout=5.0, retries=2, hedge_percentile=95),
+        "class-for-student-story": EndpointPolicy(
+            timeout=5.0, retries=2, hedge_percentile=95
+        ),
+        "classes/size": EndpointPolicy(timeout=3.0, retries=1),
+        "stage-state": EndpointPolicy(timeout=10.0, retries=2),
+        "story-state": EndpointPolicy(timeout=10.0, retries=2),
+    }
+
+    DEFAULT_POLICY = EndpointPolicy(timeout=10.0)
+
+    # Whether the server has the `story-bootstrap` batch endpoint, which
+    # returns a story state and any number of its stage states at once
+    BATCH_BOOTSTRAP = False
+
+    # How long (in seconds) to cache successful responses from each read-only
+    # endpoint. Responses from endpoints not listed here are never cached.
+    CACHE_TTLS = {
+        "student": 60.0,
+        "class-for-student-story": 60.0,
+        "classes/size": 5.0,
+    }
+
+    CACHE_SIZE = 4096
+
+    # Seconds between polls of the size of each watched class, and how long
+    # each poll may ask the server to wait for a change (0 to not ask)
+    CLASS_SIZE_INTERVAL = 5.0
+    CLASS_SIZE_LONG_POLL = 0.0
+
+    # Seconds without a new update before a queued state write is sent, and
+    # the longest any queued write may wait.
+    WRITE_DELAY = 2.0
+    WRITE_MAX_DELAY = 10.0
+
+    # Whether to sync state documents as deltas against the last version seen
+    # of each. This only takes effect for servers that report document
+    # versions; others always receive and send full documents.
+    DELTA_SYNC = True
+
+    # Whether to journal state writes locally so that they survive API
+    # outages and restarts. CDS_DISABLE_JOURNAL=true turns this off.
+    JOURNAL = os.getenv("CDS_DISABLE_JOURNAL", "").lower() != "true"
+
+    # How state documents are encoded for the wire: "json", "orjson" or
+    # "msgpack" (see `cosmicds.serialization`), and whether to compress them
+    # with "gzip" or "zstd" (see `get_compression`). Servers that refuse
+    # either get plain JSON.
+    CODEC = os.getenv("CDS_API_CODEC", "json")
+    COMPRESSION = os.getenv("CDS_API_COMPRESSION") or None
+    COMPRESS_MIN_SIZE = 1024
+
+    def __init__(
+        self,
+        client: APIClient | None = None,
+        api_url: str | None = None,
+        metrics: APIMetrics | None = None,
+    ):
+        self._client = client
+        self._metrics = metrics
+
+        if api_url is not None:
+            self.API_URL = api_url
+
+        # Checked now, rather than failing every write later
+        self.COMPRESSION = get_compression(self.COMPRESSION)
+        try:
+            self.codec: Codec = get_codec(self.CODEC)
+        except ValueError as e:
+            logger.warning("%s Using JSON instead.", e)
+            self.codec = get_codec("json")
+
+    @property
+    def client(self) -> APIClient:
+        return self._client or default_client()
+
+    @property
+    def metrics(self) -> APIMetrics:
+        return self._metrics or API_METRICS
+
+    def stats(self) -> dict:
+        """Request metrics and request policy state, as plain data. Safe to
+        call from any thread."""
+        return {**self.metrics.snapshot(), "policy": self.policy.snapshot()}
+
+    def prometheus(self) -> str:
+        """`stats` in the Prometheus text exposition format."""
+        return self.metrics.prometheus(self.policy.snapshot())
+
+    @cached_property
+    def cache(self) -> ResponseCache:
+        """Cache of decoded GET responses, keyed by URL (with its query) and
+        any extra request headers. Only to be used on the client loop."""
+        return ResponseCache(maxsize=self.CACHE_SIZE)
+
+    @cached_property
+    def baselines(self) -> ResponseCache:
+        """
+        The last known ``(version, document)`` of each state document, keyed
+        by path. Only to be used on the client loop.
+        """
+        return ResponseCache(maxsize=self.CACHE_SIZE)
+
+    @cached_property
+    def validators(self) -> ResponseCache:
+        """
+        The ``ETag`` and ``Last-Modified`` headers last received for each
+        state document, keyed by path. Only to be used on the client loop.
+        """
+        return ResponseCache(maxsize=self.CACHE_SIZE)
+
+    @property
+    def _accept(self) -> str:
+        if self.codec.content_type == JSON_CONTENT_TYPE:
+            return JSON_CONTENT_TYPE
+        return f"{self.codec.content_type}, {JSON_CONTENT_TYPE};q=0.9"
+
+    @cached_property
+    def journal(self) -> StateJournal | None:
+        if not self.JOURNAL:
+            return None
+
+        try:
+            return StateJournal()
+        except (OSError, sqlite3.Error) as e:
+            logger.warning("Unable to open the state journal: %s", e)
+            return None
+
+    @cached_property
+    def writes(self) -> WriteBehindQueue:
+        writes = WriteBehindQueue(
+            self,
+            delay=self.WRITE_DELAY,
+            max_delay=self.WRITE_MAX_DELAY,
+            journal=self.journal,
+        )
+        # Registered after the client's own `close`, so it runs before it
+        atexit.register(writes.close)
+        return writes
+
+    @cached_property
+    def policy(self) -> RequestPolicy:
+        """The request policy. Only to be used on the client loop, except for
+        `RequestPolicy.snapshot`."""
+        return RequestPolicy(self.POLICIES, self.DEFAULT_POLICY)
+
+    def _endpoint(self, path: str) -> str:
+        for endpoint in self.ENDPOINTS:
+            if path.startswith(f"/{endpoint}/") or path == f"/{endpoint}":
+                return endpoint
+        return path.strip("/").split("/")[0]
+
+    def _cache_ttl(self, path: str) -> float | None:
+        return self.CACHE_TTLS.get(self._endpoint(path))
+
+    async def _request(
+        self, method: str, path: str, *, timeout=httpx.USE_CLIENT_DEFAULT, **kwargs
+    ) -> httpx.Response:
+        return await self.client.call(
+            self._send(method, path, timeout=timeout, **kwargs)
+        )
+
+    async def _send(
+        self, method: str, path: str, *, timeout=httpx.USE_CLIENT_DEFAULT, **kwargs
+    ) -> httpx.Response:
+        # Always runs on the client loop
+        url = f"{self.API_URL}{path}"
+        endpoint = self._endpoint(path)
+
+        if method != "GET":
+            self.cache.invalidate(url)
+
+        def _request(policy_timeout):
+            if timeout is httpx.USE_CLIENT_DEFAULT and policy_timeout is not None:
+                request = self.client.http.request(method, url, timeout=policy_timeout, **kwargs)
+            else:
+                request = self.client.http.request(method, url, timeout=timeout, **kwargs)
+            return self.metrics.observe(endpoint, method, request)
+
+        return await self.policy.execute(endpoint, method, _request)
+
+    async def _get_json(self, path: str, **kwargs):
+        """
+        Returns the decoded body of a GET request to ``path``. Responses from
+        the endpoints in `CACHE_TTLS` are served from the cache while fresh,
+        and identical concurrent requests share a single upstream call.
+        """
+        return await self.client.call(self._load_json(path, **kwargs))
+
+    async def _load_json(self, path: str, copy: bool = True, **kwargs):
+        """
+        Cached responses are shared by every session, so each caller gets
+        its own copy unless ``copy`` is False, in which case the caller must
+        not modify what it gets. Always runs on the client loop.
+        """
+        ttl = self._cache_ttl(path)
+        extra_headers = kwargs.pop("headers", None) or {}
+        headers = {"Accept": self._accept, **extra_headers}
+
+        async def _fetch():
+            r = await self._send("GET", path, headers=headers, **kwargs)
+
+            if r.is_server_error:
+                r.raise_for_status()
+
+            if r.status_code == 304:
+                return NOT_MODIFIED, None
+
+            if r.is_success:
+                self._remember_validators(path, r)
+
+            return _decode_response(r), ttl if r.is_success else None
+
+        # Requests differing in their query or conditional headers mustn't
+        # share a response
+        key = str(httpx.URL(f"{self.API_URL}{path}", params=kwargs.get("params")))
+        if extra_headers:
+            key = (key, tuple(sorted(extra_headers.items())))
+
+        try:
+            value = await self.cache.get_or_load(key, _fetch)
+        except httpx.HTTPError as e:
+            # Fall back to an expired response rather than failing outright
+            value = self.cache.get(key, allow_stale=True)
+            if value is None:
+                raise
+
+            logger.warning("Serving stale response for `%s`: %s", path, e)
+
+        if copy and value is not NOT_MODIFIED:
+            value = deepcopy(value)
+        return value
+
+    async def invalidate(self, path: str):
+        """Drops any cached response for ``path``."""
+
+        async def _invalidate():
+            self.cache.invalidate(f"{self.API_URL}{path}")
+
+        await self.client.call(_invalidate())
+
+    async def get_student(self, hashed_user: str) -> dict | None:
+        student_json = await self._get_json(f"/student/{hashed_user}")
+        return student_json["student"]
+
+    async def get_class_for_student_story(self, sid: int, story_name: str) -> dict:
+        return await self._get_json(f"/class-for-student-story/{sid}/{story_name}")
+
+    async def get_class_size(self, class_id: int) -> int:
+        size_json = await self._get_json(f"/classes/size/{class_id}")
+        return size_json["size"]
+
+    async def poll_class_size(
+        self, class_id: int, known: int | None = None, wait: float = 0.0
+    ) -> int:
+        """
+        Fetches the size of a class from the server rather than the cache.
+        If ``wait`` is nonzero, servers that support it hold the request for
+        up to ``wait`` seconds until the size differs from ``known``.
+        """
+        return await self.client.call(self._poll_class_size(class_id, known, wait))
+
+    async def _poll_class_size(self, class_id: int, known: int | None, wait: float) -> int:
+        # Always runs on the client loop
+        path = f"/classes/size/{class_id}"
+        params = {}
+        timeout = httpx.USE_CLIENT_DEFAULT
+
+        if wait and known is not None:
+            params = {"wait": wait, "known": known}
+            policy_timeout = self.policy.for_endpoint(self._endpoint(path)).timeout
+            timeout = wait + (policy_timeout or DEFAULT_TIMEOUT.read)
+
+        r = await self._send("GET", path, params=params, timeout=timeout)
+        r.raise_for_status()
+        size_json = _decode_response(r)
+
+        # Readers going through the cache get the fresh size too
+        self.cache.set(f"{self.API_URL}{path}", size_json, self._cache_ttl(path))
+        return size_json["size"]
+
+    async def load_user_info(
+        self, hashed_user: str, story_name: str
+    ) -> tuple[dict, dict] | None:
+        """
+        Returns the student record and the class information for the given
+        user and story, or `None` if the student does not exist.
+        """
+        student = await self.get_student(hashed_user)
+
+        if student is None:
+            return
+
+        class_json = await self.get_class_for_student_story(student["id"], story_name)
+        return student, class_json
+
+    async def create_student(self, hashed_user: str, class_code: str) -> bool:
+        r = await self._request(
+            "POST",
+            "/students/create",
+            json={
+                "username": hashed_user,
+                "password": "",
+                "institution": "",
+                "email": f"{hashed_user}",
+                "age": 0,
+                "gender": "undefined",
+                "classroom_code": class_code,
+            },
+        )
+
+        # The cached lookup for this user says that they don't exist
+        await self.invalidate(f"/student/{hashed_user}")
+
+        return r.status_code == 201
+
+    @staticmethod
+    def stage_state_path(sid: int, story_id: str, stage_id: str) -> str:
+        return f"/stage-state/{sid}/{story_id}/{stage_id}"
+
+    @staticmethod
+    def story_state_path(sid: int, story_id: str) -> str:
+        return f"/story-state/{sid}/{story_id}"
+
+    async def get_stage_state(
+        self, sid: int, story_id: str, stage_id: str
+    ) -> dict | None:
+        state, _ = await self._get_state(self.stage_state_path(sid, story_id, stage_id))
+        return state
+
+    async def delete_stage_state(self, sid: int, story_id: str, stage_id: str) -> dict | None:
+        """
+        Returns the decoded response body, or `None` if the stage state did
+        not exist.
+        """
+        path = self.stage_state_path(sid, story_id, stage_id)
+
+        # A queued write would otherwise recreate the document afterwards
+        await self.client.call(self._forget_document(path))
+        r = await self._request("DELETE", path)
+
+        if r.status_code != 200:
+            return
+
+        return r.json()
+
+    async def get_story_state(self, sid: int, story_id: str) -> dict | None:
+        state, _ = await self._get_state(self.story_state_path(sid, story_id))
+        return state
+
+    async def get_state_document(
+        self, path: str, known_tag: str | None = None
+    ) -> tuple[dict | None, str | None]:
+        """
+        Returns the state document at ``path`` along with its tag (its ETag,
+        version or modification time), which is `None` if the server gave
+        none or the document comes from a write that is still queued.
+
+        If ``known_tag`` is given and the document still has that tag, it is
+        returned as `NOT_MODIFIED` instead, without being decoded or copied.
+        """
+        return await self._get_state(path, known_tag)
+
+    async def load_story(
+        self, sid: int, story_id: str, stage_ids: list[str]
+    ) -> tuple[dict | None, dict[str, dict | None]]:
+        """
+        Fetches a story state together with the states of the given stages,
+        and returns the story state and a dictionary of stage states keyed
+        by stage id.
+
+        This is a single request if the server has the batch endpoint (see
+        `BATCH_BOOTSTRAP`), and otherwise one wave of concurrent requests.
+        """
+        if self.BATCH_BOOTSTRAP:
+            try:
+                return await self.client.call(
+                    self._load_story_batch(sid, story_id, stage_ids)
+                )
+            except (httpx.HTTPError, KeyError, ValueError) as e:
+                logger.warning("Batch load of story `%s` failed: %s", story_id, e)
+
+        story, *stages = await asyncio.gather(
+            self.get_story_state(sid, story_id),
+            *(self.get_stage_state(sid, story_id, stage_id) for stage_id in stage_ids),
+        )
+        return story, dict(zip(stage_ids, stages))
+
+    async def _load_story_batch(self, sid: int, story_id: str, stage_ids: list[str]):
+        # Always runs on the client loop
+        bootstrap = await self._load_json(
+            f"/story-bootstrap/{sid}/{story_id}",
+            copy=False,
+            params={"stages": list(stage_ids)},
+        )
+
+        story = await self._accept_document(
+            self.story_state_path(sid, story_id), bootstrap["story"]
+        )
+        stages = {
+            stage_id: await self._accept_document(
+                self.stage_state_path(sid, story_id, stage_id),
+                bootstrap["stages"].get(stage_id),
+            )
+            for stage_id in stage_ids
+        }
+        return story, stages
+
+    async def _accept_document(self, path: str, document: dict | None) -> dict | None:
+        # Always runs on the client loop
+        pending = await self._pending_write(path)
+        if pending is not None:
+            return _decode(pending)
+
+        state = (document or {}).get("state")
+        version = (document or {}).get("version")
+        self.validators.invalidate(path)
+
+        if state is None or version is None:
+            self.baselines.invalidate(path)
+            return deepcopy(state)
+
+        self.baselines.set(path, (version, state), math.inf)
+        return deepcopy(state)
+
+    async def _get_state(
+        self, path: str, known_tag: str | None = None
+    ) -> tuple[dict | None, str | None]:
+        # A write that is still queued is newer than what the server has
+        pending = await self.client.call(self._pending_write(path))
+        if pending is not None:
+            return _decode(pending), None
+
+        try:
+            return await self.client.call(self._load_state(path, known_tag))
+        except httpx.HTTPError as e:
+            last = await self.client.call(self.writes.journaled(path))
+
+            if last is None:
+                logger.error("Failed to retrieve `%s`: %s", path, e)
+                return None, None
+
+            logger.warning("Serving `%s` from the journal: %s", path, e)
+            return _decode(last), None
+
+    async def _load_state(
+        self, path: str, known_tag: str | None = None
+    ) -> tuple[dict | None, str | None]:
+        # Always runs on the client loop
+        baseline = self.baselines.get(path)
+        params = None
+        headers = None
+
+        if baseline is not None:
+            # Ask only for what changed since our copy, if anything did
+            headers = self._conditional_headers(path, baseline)
+            if self.DELTA_SYNC and baseline[0] is not None:
+                params = {"since": baseline[0]}
+
+        try:
+            # Copied below, after the baseline is taken from it
+            state_json = await self._load_json(
+                path, copy=False, params=params, headers=headers
+            )
+        except httpx.HTTPError as e:
+            if baseline is None:
+                raise
+
+            logger.warning("Serving last known version of `%s`: %s", path, e)
+            return deepcopy(baseline[1]), None
+
+        if state_json is NOT_MODIFIED:
+            current = self.baselines.get(path)
+            if current is None:
+                # Our copy went away while the request was in flight
+                self.validators.invalidate(path)
+                return await self._load_state(path, known_tag)
+            state = current[1]
+        else:
+            if "patch" in state_json and baseline is not None:
+                state = delta.apply(baseline[1], state_json["patch"])
+            else:
+                state = state_json.get("state", None)
+
+            version = state_json.get("version")
+            if state is None or (version is None and path not in self.validators):
+                self.baselines.invalidate(path)
+                self.validators.invalidate(path)
+                return deepcopy(state), None
+
+            self.baselines.set(path, (version, state), math.inf)
+
+        tag = self._document_tag(path)
+        if known_tag is not None and tag == known_tag:
+            return NOT_MODIFIED, tag
+
+        # The baseline must not change underneath us if the caller modifies
+        # what we return
+        return deepcopy(state), tag
+
+    def _remember_validators(self, path: str, response: httpx.Response):
+        validators = {
+            name: response.headers[header]
+            for name, header in (("etag", "etag"), ("last_modified", "last-modified"))
+            if header in response.headers
+        }
+
+        if validators:
+            self.validators.set(path, validators, math.inf)
+        else:
+            self.validators.invalidate(path)
+
+    def _document_tag(self, path: str) -> str | None:
+        """The ETag of our copy of a document, or failing that its version or
+        modification time."""
+        validators = self.validators.get(path) or {}
+        if "etag" in validators:
+            return validators["etag"]
+
+        baseline = self.baselines.get(path)
+        if baseline is not None and baseline[0] is not None:
+            return f'"{baseline[0]}"'
+
+        return validators.get("last_modified")
+
+    def _conditional_headers(self, path: str, baseline: tuple) -> dict:
+        validators = self.validators.get(path) or {}
+
+        if "etag" in validators:
+            return {"If-None-Match": validators["etag"]}
+        if baseline[0] is not None:
+            return {"If-None-Match": f'"{baseline[0]}"'}
+        if "last_modified" in validators:
+            return {"If-Modified-Since": validators["last_modified"]}
+        return {}
+
+    async def _write_state(self, path: str, body: bytes) -> None:
+        """
+        Writes the encoded state document ``body`` to ``path``, as a patch
+        against the last version we know of if the server supports that.
+        Raises `httpx.HTTPStatusError` if the server refuses the write. Always
+        runs on the client loop.
+        """
+        baseline = self.baselines.get(path) if self.DELTA_SYNC else None
+        state = _decode(body)
+
+        if baseline is not None and baseline[0] is not None:
+            version, base_state = baseline
+            # Sent even when there are no changes, since the document may have
+            # moved on since our baseline; if so, the If-Match fails and the
+            # whole document is written below
+            ops = delta.diff(base_state, state)
+            r = await self._send(
+                "PATCH",
+                path,
+                content=json.dumps(ops).encode(),
+                headers={
+                    "Content-Type": "application/json-patch+json",
+                    "If-Match": f'"{version}"',
+                },
+            )
+
+            if r.is_success:
+                self._update_baseline(path, r, state)
+                return
+
+            if r.status_code in (405, 415, 501):
+                logger.info("Server does not accept state patches; sending full documents.")
+                self.DELTA_SYNC = False
+
+            # Otherwise our baseline is out of date (or the document is gone),
+            # so fall back to writing the whole document
+
+        r = await self._put_document(path, body)
+
+        if r.status_code == 415 and (
+            self.COMPRESSION or self.codec.content_type != JSON_CONTENT_TYPE
+        ):
+            logger.info("Server does not accept encoded state documents; sending JSON.")
+            self.COMPRESSION = None
+            self.codec = get_codec("json")
+            r = await self._put_document(path, self.codec.encode(state))
+
+        r.raise_for_status()
+        self._update_baseline(path, r, state)
+
+    async def _put_document(self, path: str, body: bytes) -> httpx.Response:
+        headers = {"Content-Type": codec_for_body(body).content_type}
+
+        if self.COMPRESSION and len(body) >= self.COMPRESS_MIN_SIZE:
+            body = compress(body, self.COMPRESSION)
+            headers["Content-Encoding"] = self.COMPRESSION
+
+        return await self._send("PUT", path, content=body, headers=headers)
+
+    def _update_baseline(self, path: str, response: httpx.Response, state: dict):
+        try:
+            version = response.json().get("version")
+        except (ValueError, AttributeError):
+            version = None
+
+        self._remember_validators(path, response)
+
+        if version is None and path not in self.validators:
+            self.baselines.invalidate(path)
+        else:
+            self.baselines.set(path, (version, state), math.inf)
+
+    async def _forget_document(self, path: str):
+        # Always runs on the client loop
+        await self.writes.discard(path)
+        self.baselines.invalidate(path)
+        self.validators.invalidate(path)
+
+    async def _pending_write(self, path: str) -> bytes | None:
+        body = self.writes.pending(path)
+
+        # A journaled write that has not been acknowledged is also newer
+        if body is None:
+            body = await self.writes.journaled(path, pending_only=True)
+
+        return body
+
+    async def flush_writes(self, owner: str | None = None) -> bool:
+        """
+        Sends queued state writes now (only those of ``owner``, if given)
+        and waits for them to finish. Returns False if any of them failed and
+        were left to be retried.
+        """
+        return await self.client.call(self.writes._flush(owner))
+
+    def put_stage_state(
+        self, sid: int, story_id: str, stage_id: str, state: dict, owner: str | None = None
+    ):
+        """Queues a write of a stage state. May be called from any thread."""
+        self.writes.enqueue(
+            self.stage_state_path(sid, story_id, stage_id),
+            self.codec.encode(state),
+            owner=owner,
+        )
+
+    def put_story_state(
+        self, sid: int, story_id: str, state: dict, owner: str | None = None
+    ):
+        """Queues a write of a story state. May be called from any thread."""
+        self.writes.enqueue(
+            self.story_state_path(sid, story_id), self.codec.encode(state), owner=owner
+        )
+
+
+@dataclass
+class Identity:
+    """
+    Who the user of a session is: their hash, worked out once on first use
+    after login, and their student id and class, filled in once loaded (for
+    the story named ``story_name``). Forgotten on logout
+    (`BaseAPI.clear_user`) or when the session ends.
+    """
+
+    hashed_user: str
+    student_id: int | None = None
+    class_info: dict | None = None
+    story_name: str | None = None
+
+
+class BaseAPI:
+    """
+    Blocking facade over `AsyncBaseAPI` that reads from and writes to Solara
+    reactive state. Each call blocks only the calling thread; the underlying
+    request is made on the shared `APIClient` loop.
+    """
+
+    API_URL = AsyncBaseAPI.API_URL
+
+    # How many preloaded stage states to keep for each session
+    PRELOAD_SIZE = 32
+
+    _preload_lock = threading.Lock()
+    _identity_lock = threading.Lock()
+
+    # The identity of each session's user, by kernel id
+    _identities: dict[str, Identity] = {}
+
+    @cached_property
+    def aio(self) -> AsyncBaseAPI:
+        return AsyncBaseAPI(api_url=self.API_URL)
+
+    @cached_property
+    def class_sizes(self) -> ClassSizeService:
+        """The shared watcher of class sizes (see `watch_class_size`)."""
+        return ClassSizeService(
+            self.aio,
+            interval=self.aio.CLASS_SIZE_INTERVAL,
+            long_poll=self.aio.CLASS_SIZE_LONG_POLL,
+        )
+
+    @cached_property
+    def _preloaded(self) -> dict[str | None, OrderedDict]:
+        return {}
+
+    def _preload(self, path: str, state: dict, owner: str | None = None):
+        """Keeps ``state`` for the next `get_stage_state` call for ``path``
+        in the session ``owner`` (the current session by default)."""
+        owner = owner or get_kernel_id()
+        with self._preload_lock:
+            preloaded = self._preloaded.setdefault(owner, OrderedDict())
+            preloaded[path] = state
+            preloaded.move_to_end(path)
+            while len(preloaded) > self.PRELOAD_SIZE:
+                preloaded.popitem(last=False)
+
+    def _take_preloaded(self, path: str) -> dict | None:
+        with self._preload_lock:
+            state = self._preloaded.get(get_kernel_id(), {}).pop(path, None)
+
+        # A write that is still queued is newer than what was preloaded
+        if state is not None and self.aio.writes.pending(path) is not None:
+            return None
+        return state
+
+    def _drop_preloaded(self, path: str):
+        """Drops what was preloaded for ``path`` in the current session, once
+        it has been written or deleted."""
+        with self._preload_lock:
+            self._preloaded.get(get_kernel_id(), {}).pop(path, None)
+
+    def _discard_preloaded(self, owner: str | None):
+        with self._preload_lock:
+            self._preloaded.pop(owner, None)
+            self._models.pop(owner, None)
+
+    @cached_property
+    def _models(self) -> dict[str | None, OrderedDict]:
+        return {}
+
+    def _remember_model(self, path: str, tag: str | None, model: BaseState):
+        """Remembers that ``model`` was built from the version of the document
+        at ``path`` with the given tag, for the current session."""
+        with self._preload_lock:
+            models = self._models.setdefault(get_kernel_id(), OrderedDict())
+
+            if tag is None:
+                models.pop(path, None)
+                return
+
+            models[path] = (tag, model)
+            models.move_to_end(path)
+            while len(models) > self.PRELOAD_SIZE:
+                models.popitem(last=False)
+
+    def _model_tag(self, path: str, model: BaseState) -> str | None:
+        """The tag of the document ``model`` was built from, if it is still
+        the model that `_remember_model` was given."""
+        with self._preload_lock:
+            entry = self._models.get(get_kernel_id(), {}).get(path)
+
+        if entry is None or entry[1] is not model:
+            return None
+        return entry[0]
+
+    def _run(self, coro):
+        return self.aio.client.run(coro)
+
     @cached_property
     def request_session(self):
         """
         Returns a `requests.Session` object that has the relevant authorization
         parameters to interface with the CosmicDS API server (provided that
         environment variables are set correctly).
+
+        Kept for subclasses that make their own blocking requests; new code
+        should go through `aio` instead.
         """
         session = Session()
         session.headers.update({"Authorization": os.getenv("CDS_API_KEY")})
         return session
 
+    @property
+    def identity(self) -> Identity | None:
+        """
+        The identity of the current session's user, or `None` if they are
+        not authenticated. Only the first read after login looks at
+        ``auth.user``; later reads are served from memory.
+        """
+        owner = get_kernel_id()
+        with self._identity_lock:
+            identity = self._identities.get(owner)
+
+        if identity is None:
+            hashed = self._hash_user()
+            if hashed is None:
+                return None
+
+            identity = Identity(hashed)
+
+            # Outside of a kernel there is no session to remember it for
+            if owner is not None:
+                with self._identity_lock:
+                    identity = self._identities.setdefault(owner, identity)
+
+        return identity
+
+    @classmethod
+    def _forget_identity(cls, owner: str | None):
+        with cls._identity_lock:
+            cls._identities.pop(owner, None)
+
     @property
     def hashed_user(self):
+        identity = self.identity
+        if identity is None:
+            return "User not authenticated" if auth.user.value is None else None
+        return identity.hashed_user
+
+    @staticmethod
+    def _hash_user() -> str | None:
         if auth.user.value is None:
             logger.error("Failed to create hash: user not authenticated.")
-            return "User not authenticated"
+            return
 
         userinfo = auth.user.value.get("userinfo")
 
@@ -48,64 +1351,150 @@ class BaseAPI:
 
     @property
     def user_exists(self):
-        r = self.request_session.get(f"{self.API_URL}/student/{self.hashed_user}")
-        return r.json()["student"] is not None
+        return self._run(self.aio.get_student(self.hashed_user)) is not None
 
     def update_class_size(self, state: Reactive[GlobalState]):
-        class_id = state.value.classroom.class_info["id"]
-        size_json = self.request_session.get(
-            f"{self.API_URL}/classes/size/{class_id}"
-        ).json()
-        Ref(state.fields.classroom.size).set(size_json["size"])
+        identity = self.identity
+        if identity is not None and identity.student_id is not None:
+            class_info = identity.class_info
+        else:
+            class_info = state.value.classroom.class_info
+
+        if not class_info:
+            return
+
+        class_id = class_info["id"]
+
+        # A watched class is already being kept up to date
+        size = self.class_sizes.latest(class_id)
+        if size is None:
+            size = self._run(self.aio.get_class_size(class_id))
+
+        Ref(state.fields.classroom.size).set(size)
+
+    def watch_class_size(self, state: Reactive[GlobalState]) -> Callable[[], None]:
+        """
+        Keeps ``state.classroom.size`` up to date from the shared class size
+        poller, until the returned function is called or the session ends.
+        """
+        class_info = state.value.classroom.class_info or {}
+        if class_info.get("id") is None:
+            return lambda: None
+
+        size = Ref(state.fields.classroom.size)
+        return self.class_sizes.subscribe(
+            class_info["id"],
+            size.set,
+            context=get_kernel_context(),
+            owner=get_kernel_id(),
+        )
 
     def load_user_info(self, story_name: str, state: Reactive[GlobalState]):
-        student_json = self.request_session.get(
-            f"{self.API_URL}/student/{self.hashed_user}"
-        ).json()["student"]
-        sid = student_json["id"]
+        if self._restore_user_info(story_name, state):
+            return
 
-        class_json = self.request_session.get(
-            f"{self.API_URL}/class-for-student-story/{sid}/{story_name}"
-        ).json()
+        user_info = self._run(self.aio.load_user_info(self.hashed_user, story_name))
+
+        if user_info is None:
+            logger.error("Failed to load user info: user does not exist.")
+            return
 
-        Ref(state.fields.student.id).set(sid)
+        student_json, class_json = user_info
+        self._set_user_info(story_name, state, student_json, class_json)
+
+        logger.info("Loaded user info for user `%s`.", state.value.student.id)
+
+    def bootstrap_user(
+        self, story_name: str, class_code: str, state: Reactive[GlobalState]
+    ) -> bool:
+        """
+        Loads the authenticated user's student and class information into
+        ``state``, creating the student first if they do not exist and a
+        class code was given. Returns whether the user exists afterwards.
+
+        This is meant to run off of the render path (e.g. from a task), and
+        makes one student lookup rather than separate existence and info
+        lookups.
+        """
+        if self._restore_user_info(story_name, state):
+            return True
+
+        hashed_user = self.hashed_user
+        user_info = self._run(self.aio.load_user_info(hashed_user, story_name))
+
+        if user_info is None and class_code:
+            if not self._run(self.aio.create_student(hashed_user, class_code)):
+                logger.error("Failed to create new user.")
+                return False
+
+            logger.info(
+                "Created new user `%s` with class code '%s'.",
+                hashed_user,
+                class_code,
+            )
+            user_info = self._run(self.aio.load_user_info(hashed_user, story_name))
+
+        if user_info is None:
+            return False
+
+        self._set_user_info(story_name, state, *user_info)
+
+        logger.info("Loaded user info for user `%s`.", state.value.student.id)
+
+        return True
+
+    def _set_user_info(
+        self,
+        story_name: str,
+        state: Reactive[GlobalState],
+        student_json: dict,
+        class_json: dict,
+    ):
+        identity = self.identity
+        if identity is not None:
+            identity.student_id = student_json["id"]
+            identity.class_info = class_json["class"]
+            identity.story_name = story_name
+
+        Ref(state.fields.student.id).set(student_json["id"])
         Ref(state.fields.classroom.class_info).set(class_json["class"])
         Ref(state.fields.classroom.size).set(class_json["size"])
 
-        logger.info("Loaded user info for user `%s`.", state.value.student.id)
+    def _restore_user_info(self, story_name: str, state: Reactive[GlobalState]) -> bool:
+        """Fills ``state`` in from the session's identity, if it already holds
+        the user's info for ``story_name``, and returns whether it did."""
+        identity = self.identity
+        if (
+            identity is None
+            or identity.student_id is None
+            or identity.story_name != story_name
+        ):
+            return False
+
+        Ref(state.fields.student.id).set(identity.student_id)
+        Ref(state.fields.classroom.class_info).set(identity.class_info)
+        self.update_class_size(state)
+        return True
 
     def create_new_user(
         self, story_name: str, class_code: str, state: Reactive[GlobalState]
     ):
-        r = self.request_session.get(f"{self.API_URL}/student/{self.hashed_user}")
-        student = r.json()["student"]
+        hashed_user = self.hashed_user
+        student = self._run(self.aio.get_student(hashed_user))
 
         if student is not None:
             logger.error(
-                "Failed to create user `%s`: user already exists.", self.hashed_user
+                "Failed to create user `%s`: user already exists.", hashed_user
             )
             return
 
-        r = self.request_session.post(
-            f"{self.API_URL}/students/create",
-            json={
-                "username": self.hashed_user,
-                "password": "",
-                "institution": "",
-                "email": f"{self.hashed_user}",
-                "age": 0,
-                "gender": "undefined",
-                "classroom_code": class_code,
-            },
-        )
-
-        if r.status_code != 201:
+        if not self._run(self.aio.create_student(hashed_user, class_code)):
             logger.error("Failed to create new user.")
             return
 
         logger.info(
             "Created new user `%s` with class code '%s'.",
-            self.hashed_user,
+            hashed_user,
             class_code,
         )
 
@@ -117,7 +1506,27 @@ class BaseAPI:
         local_state: Reactive[BaseLocalState],
         component_state: Reactive[BaseState],
     ):
-        raise NotImplementedError()
+        """
+        Queues a write of the component state. Rapid successive calls for the
+        same stage result in a single request; see `WriteBehindQueue`.
+        """
+        if not global_state.value.update_db:
+            logger.info("Skipping write of Component state.")
+            return
+
+        if _unchanged(component_state.value):
+            logger.debug("Component state is unchanged; skipping write.")
+            return
+
+        sid = global_state.value.student.id
+        story_id = local_state.value.story_id
+        stage_id = component_state.value.stage_id
+
+        self.aio.put_stage_state(
+            sid, story_id, stage_id, component_state.value.as_dict(), owner=get_kernel_id()
+        )
+        self._drop_preloaded(self.aio.stage_state_path(sid, story_id, stage_id))
+        component_state.value.checkpoint()
 
     def get_stage_state(
         self,
@@ -125,19 +1534,29 @@ class BaseAPI:
         local_state: Reactive[BaseLocalState],
         component_state: Reactive[BaseState],
     ) -> BaseState | None:
-        
+
         if not global_state.value.update_db:
             logger.info("Skipping retrieval of Component state.")
             return component_state.value
-        
-        stage_json = (
-            self.request_session.get(
-                f"{self.API_URL}/stage-state/{global_state.value.student.id}/"
-                f"{local_state.value.story_id}/{component_state.value.stage_id}"
+
+        sid = global_state.value.student.id
+        story_id = local_state.value.story_id
+        stage_id = component_state.value.stage_id
+
+        path = self.aio.stage_state_path(sid, story_id, stage_id)
+        tag = None
+
+        stage_json = self._take_preloaded(path)
+        if stage_json is None:
+            stage_json, tag = self._run(
+                self.aio.get_state_document(
+                    path, known_tag=self._model_tag(path, component_state.value)
+                )
             )
-            .json()
-            .get("state", None)
-        )
+
+        if stage_json is NOT_MODIFIED:
+            logger.info("Component state is unchanged in the database.")
+            return component_state.value
 
         if stage_json is None:
             logger.error(
@@ -148,6 +1567,10 @@ class BaseAPI:
             return
 
         component_state.set(component_state.value.__class__(**stage_json))
+        # An equal model doesn't replace the current one, so remember whichever is kept
+        self._remember_model(path, tag, component_state.value)
+        # What was just loaded is what the server has
+        component_state.value.checkpoint()
 
         logger.info("Updated component state from database.")
 
@@ -162,13 +1585,15 @@ class BaseAPI:
         if not global_state.value.update_db:
             logger.info("Skipping deletion of stage state.")
             return
-        
-        r = self.request_session.delete(
-            f"{self.API_URL}/stage-state/{global_state.value.student.id}/"
-            f"{local_state.value.story_id}/{component_state.value.stage_id}"
-        )
 
-        if r.status_code != 200:
+        sid = global_state.value.student.id
+        story_id = local_state.value.story_id
+        stage_id = component_state.value.stage_id
+
+        self._drop_preloaded(self.aio.stage_state_path(sid, story_id, stage_id))
+        result = self._run(self.aio.delete_stage_state(sid, story_id, stage_id))
+
+        if result is None:
             logger.error(
                 "Stage state for stage `%s`, story `%s` user `%s` did not exist in database.",
                 component_state.value.stage_id,
@@ -177,7 +1602,6 @@ class BaseAPI:
             )
             return
 
-        result = r.json()
         if not result.get("success", False):
             logger.error(
                 "Error deleting stage state for stage `%s`, story `%s` user `%s`.",
@@ -191,14 +1615,11 @@ class BaseAPI:
         self, global_state: Reactive[GlobalState], local_state: Reactive[BaseLocalState]
     ) -> BaseLocalState | None:
         if global_state.value.update_db:
-        
-            story_json = (
-                self.request_session.get(
-                    f"{self.API_URL}/story-state/{global_state.value.student.id}/"
-                    f"{local_state.value.story_id}"
+
+            story_json = self._run(
+                self.aio.get_story_state(
+                    global_state.value.student.id, local_state.value.story_id
                 )
-                .json()
-                .get("state", None)
             )
 
             if story_json is None:
@@ -216,12 +1637,59 @@ class BaseAPI:
                 "story": type(local_state.value)(title=local_state.value.title, story_id=local_state.value.story_id).as_dict(),
             }
 
+        return self._apply_story_state(global_state, local_state, story_json)
+
+    def load_story_states(
+        self,
+        global_state: Reactive[GlobalState],
+        local_state: Reactive[BaseLocalState],
+        stage_ids: list[str],
+    ) -> BaseLocalState | None:
+        """
+        Restores the global and local states like `get_app_story_states`,
+        while fetching the states of the given stages at the same time. The
+        stage states are kept for this session, so that the first
+        `get_stage_state` call for each stage does not make a request.
+        """
+        if not global_state.value.update_db:
+            return self.get_app_story_states(global_state, local_state)
+
+        sid = global_state.value.student.id
+        story_id = local_state.value.story_id
+
+        story_json, stage_jsons = self._run(self.aio.load_story(sid, story_id, stage_ids))
+
+        for stage_id, stage_json in stage_jsons.items():
+            if stage_json is not None:
+                self._preload(self.aio.stage_state_path(sid, story_id, stage_id), stage_json)
+
+        if story_json is None:
+            logger.error(
+                "Failed to retrieve state for story `%s` for user `%s`.",
+                story_id,
+                sid,
+            )
+            return
+
+        return self._apply_story_state(global_state, local_state, story_json)
+
+    def _apply_story_state(
+        self,
+        global_state: Reactive[GlobalState],
+        local_state: Reactive[BaseLocalState],
+        story_json: dict,
+    ) -> BaseLocalState:
+        # What our own server sent back can be restored without revalidating
         global_state_json = story_json.get("app", {})
-        BaseAPI._update_state(global_state, global_state_json)
+        BaseAPI._update_state(global_state, global_state_json, trusted=True)
 
         local_state_json = story_json.get("story", {})
         logger.debug(local_state_json)
-        BaseAPI._update_state(local_state, local_state_json)
+        BaseAPI._update_state(local_state, local_state_json, trusted=True)
+
+        # What was just restored is what the server has
+        global_state.value.checkpoint()
+        local_state.value.checkpoint()
 
         logger.info("Updated local state from database.")
 
@@ -232,18 +1700,97 @@ class BaseAPI:
         global_state: Reactive[GlobalState],
         local_state: Reactive[BaseLocalState],
     ):
-       raise NotImplementedError() 
+        """
+        Queues a write of the global and local states. Rapid successive calls
+        result in a single request; see `WriteBehindQueue`.
+        """
+        if not global_state.value.update_db:
+            logger.info("Skipping write of Global and Local states.")
+            return
+
+        if _unchanged(global_state.value, local_state.value):
+            logger.debug("Global and Local states are unchanged; skipping write.")
+            return
+
+        self.aio.put_story_state(
+            global_state.value.student.id,
+            local_state.value.story_id,
+            {
+                "app": global_state.value.as_dict(),
+                "story": local_state.value.as_dict(),
+            },
+            owner=get_kernel_id(),
+        )
+        global_state.value.checkpoint()
+        local_state.value.checkpoint()
+
+    def flush_writes(self, wait: bool = False):
+        """
+        Sends the current session's queued state writes now (or all queued
+        writes when called outside of a session).
+        """
+        self.aio.writes.flush(get_kernel_id(), wait=wait)
 
     @staticmethod
     def clear_user(state: Reactive[GlobalState]):
+        BaseAPI._forget_identity(get_kernel_id())
         Ref(state.fields.student.id).set(0)
         Ref(state.fields.classroom.class_info).set({})
         Ref(state.fields.classroom.size).set(0)
 
     @staticmethod
-    def _update_state(state: Reactive[BaseState], data: dict):
+    def _update_state(state: Reactive[BaseState], data: dict, trusted: bool = False):
+        """
+        Updates ``state`` in place from ``data``. Trusted data, i.e. what we
+        wrote to our own server, is restored without revalidation and only
+        touches the fields that changed (see `cosmicds.hydration`), keeping
+        those it leaves out; other data is validated as a whole new model.
+        Only pass ``trusted=True`` for complete documents from our server.
+        """
+        if trusted:
+            hydrate(state.value, data)
+            return
+
         new_state = state.value.__class__(**data)
         state.value.__dict__.update(new_state.__dict__)
 
 
+def _unchanged(*states: BaseState) -> bool:
+    """Whether all of ``states`` track changes and none has any."""
+    return all(state.TRACK_CHANGES and not state.is_dirty for state in states)
+
+
+def _decode(body: bytes):
+    """Decodes a state document we encoded, with whichever codec was in use."""
+    return codec_for_body(body).decode(body)
+
+
+def _decode_response(response: httpx.Response):
+    return codec_for_content_type(response.headers.get("content-type")).decode(
+        response.content
+    )
+
+
+# Metrics of every request made through the API client, unless an
+# `AsyncBaseAPI` is given its own
+API_METRICS = APIMetrics()
+
 BASE_API = BaseAPI()
+
+if os.getenv("CDS_METRICS_PORT"):
+    start_metrics_server(int(os.environ["CDS_METRICS_PORT"]), BASE_API.aio.prometheus)
+
+
+def _on_session_start():
+    owner = get_kernel_id()
+
+    def cleanup():
+        BASE_API.aio.writes.flush(owner, wait=True)
+        BASE_API._discard_preloaded(owner)
+        BASE_API._forget_identity(owner)
+        BASE_API.class_sizes.unsubscribe_owner(owner)
+
+    return cleanup
+
+
+solara.lab.on_kernel_start(_on_session_start)
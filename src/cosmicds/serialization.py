@@ -0,0 +1,256 @@
+import gzip
+import importlib.util
+import json
+from datetime import datetime
+
+import numpy as np
+from glue.core.state_objects import State
+
+from .logger import setup_logger
+from .utils import CDSJSONEncoder
+
+__all__ = [
+    "Codec",
+    "JSONCodec",
+    "ORJSONCodec",
+    "MsgpackCodec",
+    "get_codec",
+    "codec_for_content_type",
+    "codec_for_body",
+    "get_compression",
+    "compress",
+    "decompress",
+]
+
+logger = setup_logger("API")
+
+# The faster codecs and zstd compression need optional packages
+ORJSON_AVAILABLE = importlib.util.find_spec("orjson") is not None
+MSGPACK_AVAILABLE = importlib.util.find_spec("msgpack") is not None
+ZSTD_AVAILABLE = importlib.util.find_spec("zstandard") is not None
+
+JSON_CONTENT_TYPE = "application/json"
+MSGPACK_CONTENT_TYPE = "application/msgpack"
+
+# The msgpack extension type code for a raw typed-array buffer
+NDARRAY_EXT = 1
+
+
+class Codec:
+    """
+    Turns state documents into bytes for the wire, and back.
+
+    Arrays are decoded to lists by every codec, so that documents compare
+    and diff the same whichever codec carried them.
+    """
+
+    name: str
+    content_type: str
+
+    def encode(self, obj) -> bytes:
+        raise NotImplementedError
+
+    def decode(self, data: bytes):
+        raise NotImplementedError
+
+
+class JSONCodec(Codec):
+    """Plain JSON, through `CDSJSONEncoder`. Understood by every server."""
+
+    name = "json"
+    content_type = JSON_CONTENT_TYPE
+
+    def encode(self, obj) -> bytes:
+        return json.dumps(obj, cls=CDSJSONEncoder).encode()
+
+    def decode(self, data: bytes):
+        return json.loads(data)
+
+
+class ORJSONCodec(JSONCodec):
+    """
+    JSON through orjson, which serializes numpy arrays natively. The output
+    is ordinary JSON, so any server that accepts `JSONCodec` accepts this.
+    """
+
+    name = "orjson"
+
+    def __init__(self):
+        import orjson
+
+        self._orjson = orjson
+        self._options = (
+            orjson.OPT_SERIALIZE_NUMPY
+            | orjson.OPT_NON_STR_KEYS
+            # Keep `CDSJSONEncoder`'s formatting of datetimes
+            | orjson.OPT_PASSTHROUGH_DATETIME
+        )
+
+    def encode(self, obj) -> bytes:
+        return self._orjson.dumps(obj, default=_default, option=self._options)
+
+    def decode(self, data: bytes):
+        try:
+            return self._orjson.loads(data)
+        except self._orjson.JSONDecodeError:
+            # The standard library writes NaN and Infinity, which orjson rejects
+            return json.loads(data)
+
+
+class MsgpackCodec(Codec):
+    """
+    msgpack, with numeric numpy arrays sent as their raw buffers rather than
+    as lists of numbers.
+    """
+
+    name = "msgpack"
+    content_type = MSGPACK_CONTENT_TYPE
+
+    def __init__(self):
+        import msgpack
+
+        self._msgpack = msgpack
+
+    def encode(self, obj) -> bytes:
+        return self._msgpack.packb(obj, default=self._default, use_bin_type=True)
+
+    def decode(self, data: bytes):
+        return self._msgpack.unpackb(
+            data, ext_hook=self._ext_hook, strict_map_key=False
+        )
+
+    def _default(self, obj):
+        if isinstance(obj, np.ndarray) and obj.dtype.kind in "biuf":
+            header = self._msgpack.packb(
+                [obj.dtype.str, list(obj.shape)], use_bin_type=True
+            )
+            buffer = np.ascontiguousarray(obj).tobytes()
+            return self._msgpack.ExtType(NDARRAY_EXT, header + buffer)
+        return _default(obj)
+
+    def _ext_hook(self, code: int, data: bytes):
+        if code != NDARRAY_EXT:
+            return self._msgpack.ExtType(code, data)
+
+        unpacker = self._msgpack.Unpacker(use_list=True)
+        unpacker.feed(data)
+        dtype, shape = unpacker.unpack()
+        buffer = data[unpacker.tell():]
+        return np.frombuffer(buffer, dtype=dtype).reshape(shape).tolist()
+
+
+def _default(obj):
+    if isinstance(obj, np.integer):
+        return int(obj)
+    if isinstance(obj, np.floating):
+        return float(obj)
+    if isinstance(obj, np.bool_):
+        return bool(obj)
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, State):
+        return obj.as_dict()
+    if isinstance(obj, datetime):
+        return f"{obj}"
+    raise TypeError(f"Object of type {type(obj).__name__} is not serializable")
+
+
+_CODECS = {
+    "json": (JSONCodec, True),
+    "orjson": (ORJSONCodec, ORJSON_AVAILABLE),
+    "msgpack": (MsgpackCodec, MSGPACK_AVAILABLE),
+}
+
+_INSTANCES = {}
+
+
+def get_codec(name: str = "json") -> Codec:
+    """
+    Returns the codec called ``name``, or `JSONCodec` if that codec's
+    package is not installed.
+    """
+    name = (name or "json").lower()
+    if name not in _CODECS:
+        raise ValueError(f"Unknown codec `{name}`; expected one of {list(_CODECS)}.")
+
+    cls, available = _CODECS[name]
+    if not available:
+        logger.warning("The `%s` codec is not installed; using JSON instead.", name)
+        cls = JSONCodec
+
+    if cls not in _INSTANCES:
+        _INSTANCES[cls] = cls()
+    return _INSTANCES[cls]
+
+
+def codec_for_content_type(content_type: str | None) -> Codec:
+    """The codec for a body of the given content type. Anything that isn't
+    msgpack is treated as JSON."""
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    if media_type in (MSGPACK_CONTENT_TYPE, "application/x-msgpack"):
+        return get_codec("msgpack")
+    return _json_codec()
+
+
+def codec_for_body(data: bytes) -> Codec:
+    """
+    The codec that encoded the state document ``data``, judging by its first
+    byte. A JSON object starts with ``{``, and a msgpack map with a map
+    marker, so the two never clash.
+    """
+    if data and (0x80 <= data[0] <= 0x8F or data[0] in (0xDE, 0xDF)):
+        return get_codec("msgpack")
+    return _json_codec()
+
+
+def _json_codec() -> Codec:
+    # Any JSON decodes the same way, so use the fastest decoder we have
+    return get_codec("orjson" if ORJSON_AVAILABLE else "json")
+
+
+def get_compression(encoding: str | None) -> str | None:
+    """
+    Returns ``encoding`` if `compress` supports it, and otherwise the nearest
+    encoding that it does: gzip in place of zstd if ``zstandard`` is not
+    installed, and no compression in place of anything unknown.
+    """
+    encoding = (encoding or "").lower()
+    if encoding in ("", "identity"):
+        return None
+    if encoding == "gzip":
+        return encoding
+
+    if encoding == "zstd":
+        if ZSTD_AVAILABLE:
+            return encoding
+        logger.warning("zstd compression is not installed; using gzip instead.")
+        return "gzip"
+
+    logger.warning("Unknown compression `%s`; sending uncompressed.", encoding)
+    return None
+
+
+def compress(data: bytes, encoding: str | None) -> bytes:
+    """Compresses ``data`` for the given ``Content-Encoding``."""
+    if not encoding or encoding == "identity":
+        return data
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=5)
+    if encoding == "zstd" and ZSTD_AVAILABLE:
+        import zstandard
+
+        return zstandard.ZstdCompressor().compress(data)
+    raise ValueError(f"Unsupported content encoding `{encoding}`.")
+
+
+def decompress(data: bytes, encoding: str | None) -> bytes:
+    """Reverses `compress`."""
+    if not encoding or encoding == "identity":
+        return data
+    if encoding == "gzip":
+        return gzip.decompress(data)
+    if encoding == "zstd" and ZSTD_AVAILABLE:
+        import zstandard
+
+        return zstandard.ZstdDecompressor().decompress(data)
+    raise ValueError(f"Unsupported content encoding `{encoding}`.")
@@ -0,0 +1,385 @@
+"""
+A local stand-in for the parts of the CosmicDS API server that
+`cosmicds.remote` uses, for measuring the API client offline.
+
+The stand-in keeps everything in memory, and can add latency and inject
+errors into its responses. Use it in-process through `transport`, or serve
+it on localhost with ``python -m cosmicds.stand_in``.
+"""
+
+import asyncio
+import random
+import time
+from collections import Counter, OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+
+import httpx
+from starlette.applications import Starlette
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+from . import delta
+from .serialization import JSON_CONTENT_TYPE, codec_for_content_type, decompress
+
+__all__ = ["StandInAPI"]
+
+
+class _Document:
+    """A versioned state document, with a short history of past versions so
+    that changes since a recent version can be served as a patch."""
+
+    HISTORY = 16
+
+    def __init__(self):
+        self.version = 0
+        self.state = None
+        self.history = OrderedDict()
+        self.modified = time.time()
+
+    def update(self, state):
+        self.history[self.version] = self.state
+        while len(self.history) > self.HISTORY:
+            self.history.popitem(last=False)
+        self.version += 1
+        self.state = state
+        self.modified = time.time()
+
+    @property
+    def headers(self) -> dict:
+        return {
+            "ETag": f'"{self.version}"',
+            "Last-Modified": formatdate(self.modified, usegmt=True),
+        }
+
+    def not_modified(self, request: Request) -> bool:
+        """Whether the client's copy, described by the conditional headers of
+        ``request``, is still current. ``If-None-Match`` takes precedence."""
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(",")]
+            return "*" in tags or self.headers["ETag"] in tags
+
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since is not None:
+            try:
+                since = parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+            # HTTP dates only have whole seconds
+            return int(self.modified) <= since
+
+        return False
+
+
+class StandInAPI:
+    """
+    In-memory stand-in for the CosmicDS API server.
+
+    Parameters
+    ----------
+    latency : float
+        Seconds added to every response.
+    jitter : float
+        Up to this many extra seconds, chosen uniformly at random, are added
+        to every response.
+    error_rate : float
+        The fraction of requests that fail with a 503 response.
+    class_sizes : dict, optional
+        Initial number of students in each class, keyed by class id. Class
+        codes are the string form of the class ids.
+    seed : int, optional
+        Seed for the random number generator used for jitter and errors.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        class_sizes: dict | None = None,
+        seed: int | None = None,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.requests = Counter()
+
+        self._random = random.Random(seed)
+        self._students = {}
+        self._student_classes = {}
+        self._class_sizes = dict(class_sizes or {0: 0})
+        self._class_changed = asyncio.Condition()
+        self._documents = {}
+
+        self.app = Starlette(
+            routes=[
+                Route("/student/{username}", self._get_student),
+                Route("/students/create", self._create_student, methods=["POST"]),
+                Route(
+                    "/class-for-student-story/{sid:int}/{story}",
+                    self._get_class_for_student_story,
+                ),
+                Route("/classes/size/{class_id:int}", self._get_class_size),
+                Route(
+                    "/stage-state/{sid:int}/{story}/{stage}",
+                    self._state,
+                    methods=["GET", "PUT", "PATCH", "DELETE"],
+                ),
+                Route(
+                    "/story-state/{sid:int}/{story}",
+                    self._state,
+                    methods=["GET", "PUT", "PATCH"],
+                ),
+                Route("/story-bootstrap/{sid:int}/{story}", self._story_bootstrap),
+            ],
+        )
+        self.app.add_middleware(GZipMiddleware, minimum_size=1024)
+        self.app.add_middleware(_StandInMiddleware, stand_in=self)
+
+    @property
+    def transport(self) -> httpx.AsyncBaseTransport:
+        """A transport that sends requests to this stand-in in-process."""
+        return httpx.ASGITransport(app=self.app)
+
+    def endpoint(self, path: str) -> str:
+        """The name of the endpoint that ``path`` belongs to, for counting."""
+        parts = path.strip("/").split("/")
+        return "/".join(parts[:2]) if parts[0] == "classes" else parts[0]
+
+    async def _delay(self):
+        delay = self.latency + self._random.uniform(0, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def _should_fail(self) -> bool:
+        return self._random.random() < self.error_rate
+
+    @staticmethod
+    async def _read_body(request: Request):
+        """Decodes a request body according to its content type and encoding,
+        or raises `ValueError` or `OSError` if it can't."""
+        body = decompress(
+            await request.body(), request.headers.get("content-encoding")
+        )
+        return codec_for_content_type(request.headers.get("content-type")).decode(body)
+
+    @staticmethod
+    def _respond(
+        request: Request, content, status_code: int = 200, headers: dict | None = None
+    ) -> Response:
+        """Encodes a response in the first format the client accepts."""
+        for media_type in request.headers.get("accept", "").split(","):
+            codec = codec_for_content_type(media_type)
+            if codec.content_type != JSON_CONTENT_TYPE:
+                return Response(
+                    codec.encode(content),
+                    status_code=status_code,
+                    headers=headers,
+                    media_type=codec.content_type,
+                )
+            if media_type.strip():
+                break
+
+        return JSONResponse(content, status_code=status_code, headers=headers)
+
+    async def _get_student(self, request: Request):
+        student = self._students.get(request.path_params["username"])
+        return JSONResponse({"student": student})
+
+    async def _create_student(self, request: Request):
+        info = await request.json()
+        username = info["username"]
+
+        if username in self._students:
+            return JSONResponse({"error": "Student already exists"}, status_code=409)
+
+        try:
+            class_id = int(info["classroom_code"])
+        except (KeyError, ValueError):
+            return JSONResponse({"error": "Invalid class code"}, status_code=400)
+
+        if class_id not in self._class_sizes:
+            return JSONResponse({"error": "Invalid class code"}, status_code=400)
+
+        sid = len(self._students) + 1
+        self._students[username] = {"id": sid, "username": username}
+        self._student_classes[sid] = class_id
+        self._class_sizes[class_id] += 1
+
+        async with self._class_changed:
+            self._class_changed.notify_all()
+
+        return JSONResponse({"student_info": self._students[username]}, status_code=201)
+
+    async def _get_class_for_student_story(self, request: Request):
+        class_id = self._student_classes.get(request.path_params["sid"])
+
+        if class_id is None:
+            return JSONResponse({"class": None, "size": 0})
+
+        return JSONResponse(
+            {
+                "class": {"id": class_id, "code": str(class_id)},
+                "size": self._class_sizes[class_id],
+            }
+        )
+
+    async def _get_class_size(self, request: Request):
+        """Returns the size of a class. With ``?wait=seconds&known=size``,
+        holds the request until the size differs from ``known`` or ``wait``
+        seconds pass (long polling)."""
+        class_id = request.path_params["class_id"]
+
+        if class_id not in self._class_sizes:
+            return JSONResponse({"error": "No such class"}, status_code=404)
+
+        try:
+            wait = float(request.query_params.get("wait", 0))
+            known = int(request.query_params["known"])
+        except (KeyError, ValueError):
+            wait = 0
+
+        if wait > 0:
+            async with self._class_changed:
+                try:
+                    await asyncio.wait_for(
+                        self._class_changed.wait_for(
+                            lambda: self._class_sizes[class_id] != known
+                        ),
+                        wait,
+                    )
+                except asyncio.TimeoutError:
+                    pass
+
+        return JSONResponse({"size": self._class_sizes[class_id]})
+
+    def _snapshot(self, path: str) -> dict | None:
+        document = self._documents.get(path)
+        if document is None or document.state is None:
+            return None
+        return {"state": document.state, "version": document.version}
+
+    async def _story_bootstrap(self, request: Request):
+        """Batch endpoint returning a story state and the requested stage
+        states (``?stages=a&stages=b``) in one response."""
+        sid = request.path_params["sid"]
+        story = request.path_params["story"]
+
+        return self._respond(
+            request,
+            {
+                "story": self._snapshot(f"/story-state/{sid}/{story}"),
+                "stages": {
+                    stage: self._snapshot(f"/stage-state/{sid}/{story}/{stage}")
+                    for stage in request.query_params.getlist("stages")
+                },
+            },
+        )
+
+    async def _state(self, request: Request):
+        path = request.url.path
+        document = self._documents.get(path)
+
+        if request.method == "GET":
+            if document is None or document.state is None:
+                return JSONResponse({"state": None}, status_code=404)
+
+            if document.not_modified(request):
+                return Response(status_code=304, headers=document.headers)
+
+            since = request.query_params.get("since", "")
+            if since.isdigit():
+                since = int(since)
+                base = (
+                    document.state
+                    if since == document.version
+                    else document.history.get(since)
+                )
+                if base is not None:
+                    return self._respond(
+                        request,
+                        {
+                            "patch": delta.diff(base, document.state),
+                            "version": document.version,
+                        },
+                        headers=document.headers,
+                    )
+
+            return self._respond(
+                request,
+                {"state": document.state, "version": document.version},
+                headers=document.headers,
+            )
+
+        if request.method == "DELETE":
+            if document is None or document.state is None:
+                return JSONResponse({"success": False}, status_code=404)
+            del self._documents[path]
+            return JSONResponse({"success": True})
+
+        try:
+            body = await self._read_body(request)
+        except (ValueError, OSError) as e:
+            return JSONResponse({"error": str(e)}, status_code=415)
+
+        if request.method == "PUT":
+            document = self._documents.setdefault(path, _Document())
+            document.update(body)
+            return JSONResponse({"version": document.version}, headers=document.headers)
+
+        # PATCH
+        if document is None or document.state is None:
+            return JSONResponse({"error": "No such document"}, status_code=404)
+
+        if request.headers.get("if-match", "").strip('"') != str(document.version):
+            return JSONResponse({"error": "Version mismatch"}, status_code=412)
+
+        document.update(delta.apply(document.state, body))
+        return JSONResponse({"version": document.version}, headers=document.headers)
+
+
+class _StandInMiddleware:
+    """Counts requests, and adds latency and injected errors to them."""
+
+    def __init__(self, app, stand_in: StandInAPI):
+        self.app = app
+        self.stand_in = stand_in
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stand_in = self.stand_in
+        stand_in.requests[stand_in.endpoint(scope["path"])] += 1
+        await stand_in._delay()
+
+        if stand_in._should_fail():
+            response = Response("Service unavailable", status_code=503)
+            return await response(scope, receive, send)
+
+        await self.app(scope, receive, send)
+
+
+def main(args=None):
+    import argparse
+
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Serve a CosmicDS API stand-in.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    options = parser.parse_args(args)
+
+    stand_in = StandInAPI(
+        latency=options.latency, jitter=options.jitter, error_rate=options.error_rate
+    )
+    uvicorn.run(stand_in.app, host=options.host, port=options.port)
+
+
+if __name__ == "__main__":
+    main()
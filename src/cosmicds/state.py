@@ -1,10 +1,16 @@
 import os
-from pydantic import BaseModel
-from functools import cached_property
+from contextlib import contextmanager
+from weakref import WeakKeyDictionary
+from pydantic import BaseModel, PrivateAttr
+from typing import ClassVar, Iterable
 from glue_jupyter import JupyterApplication
 from glue.core import DataCollection, Session
 import solara
 from glue.core import Data, DataCollection
+from glue.core.hub import Hub
+from glue.core.message import Message
+
+from .glue_apps import get_glue_app
 
 
 update_db_init = True
@@ -19,7 +25,113 @@ else:
     print("Database updates enabled.")
 
 
-class BaseState(BaseModel):
+class TrackedModel(BaseModel):
+    """
+    A model that can record which of its fields have changed since its last
+    `checkpoint`, through attribute assignment or `model_copy` updates
+    (which is how `solara.toestand.Ref` updates fields). Changes made inside
+    mutable field values, such as ``model.some_dict["key"] = value``, are
+    not seen.
+
+    A newly built model (including one that replaces another, as in
+    ``state.set(Model(...))``) has nothing in common with what was last
+    saved, so every one of its fields starts out changed.
+
+    Tracking is opt-in: subclasses set ``TRACK_CHANGES = True`` to enable it.
+    Nested tracked models count towards their parent's `dirty_fields`.
+    """
+
+    TRACK_CHANGES: ClassVar[bool] = False
+
+    _dirty: set[str] = PrivateAttr(default_factory=set)
+
+    def model_post_init(self, context):
+        super().model_post_init(context)
+        if self.TRACK_CHANGES:
+            self._dirty = set(type(self).model_fields)
+
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        if self.TRACK_CHANGES and name in type(self).model_fields:
+            self._dirty.add(name)
+
+    def model_copy(self, *, update=None, deep=False):
+        copy = super().model_copy(update=update, deep=deep)
+        if self.TRACK_CHANGES:
+            # The private attributes of a shallow copy share the same set
+            copy._dirty = self._dirty | set(update or ())
+        return copy
+
+    def __eq__(self, other):
+        # Two models are equal regardless of what each has seen change
+        if not isinstance(other, BaseModel):
+            return NotImplemented
+        if type(self) is not type(other):
+            return False
+        return (
+            all(
+                self.__dict__.get(name) == other.__dict__.get(name)
+                for name in type(self).model_fields
+            )
+            and self.__pydantic_extra__ == other.__pydantic_extra__
+            and _untracked_private(self) == _untracked_private(other)
+        )
+
+    @property
+    def dirty_fields(self) -> set[str]:
+        """The fields that have changed since the last checkpoint."""
+        if not self.TRACK_CHANGES:
+            return set()
+
+        dirty = set(self._dirty)
+        for name in type(self).model_fields:
+            value = self.__dict__.get(name)
+            if isinstance(value, TrackedModel) and value.dirty_fields:
+                dirty.add(name)
+        return dirty
+
+    @property
+    def is_dirty(self) -> bool:
+        return bool(self.dirty_fields)
+
+    def checkpoint(self):
+        """Marks the current values, including those of nested tracked
+        models, as unchanged."""
+        self._dirty = set()
+        for name in type(self).model_fields:
+            value = self.__dict__.get(name)
+            if isinstance(value, TrackedModel):
+                value.checkpoint()
+
+    def dump_changes(self) -> dict:
+        """
+        Serializes only the fields that changed since the last checkpoint.
+        Nested tracked models contribute only their own changes, so the
+        result is a partial document, as accepted by
+        `cosmicds.hydration.hydrate`.
+        """
+        dirty = self.dirty_fields
+        changes = self.model_dump(
+            include={
+                name
+                for name in dirty
+                if not isinstance(self.__dict__.get(name), TrackedModel)
+            }
+        )
+        for name in dirty:
+            value = self.__dict__.get(name)
+            if isinstance(value, TrackedModel):
+                # A nested model replaced wholesale may have no changes of its own
+                changes[name] = value.dump_changes() if value.is_dirty else value.model_dump()
+        return changes
+
+
+def _untracked_private(model: BaseModel) -> dict:
+    private = model.__pydantic_private__ or {}
+    return {name: value for name, value in private.items() if name != "_dirty"}
+
+
+class BaseState(TrackedModel):
     def as_dict(self):
         return self.model_dump()
 
@@ -27,16 +139,22 @@ class BaseState(BaseModel):
         return self.model_copy(update=new)
 
 
-class Student(BaseModel):
+class Student(TrackedModel):
+    TRACK_CHANGES = True
+
     id: int = None
 
 
-class Classroom(BaseModel):
+class Classroom(TrackedModel):
+    TRACK_CHANGES = True
+
     class_info: dict | None = {}
     size: int = 0
 
 
-class Speech(BaseModel):
+class Speech(TrackedModel):
+    TRACK_CHANGES = True
+
     pitch: float = 1.0
     rate: float = 1.0
     autoread: bool = False
@@ -51,7 +169,51 @@ class BaseLocalState(BaseState):
     max_route_index: int | None = None
 
 
+# Hubs in the middle of a batch of data updates, and the messages they hold
+_DEFERRED: "WeakKeyDictionary[Hub, dict]" = WeakKeyDictionary()
+
+
+@contextmanager
+def deferred_messages(hub: Hub):
+    """
+    Holds back messages broadcast to ``hub`` until the block exits, then
+    delivers them once each: of several messages of the same type, from the
+    same sender and about the same data and attribute, only the last is
+    delivered, in the place of the first. Nested blocks join the outermost.
+    """
+    if hub in _DEFERRED:
+        yield
+        return
+
+    messages: dict[tuple, Message] = {}
+    _DEFERRED[hub] = messages
+
+    def defer(message: Message):
+        # Honor `Hub.ignore_callbacks` as it stands when the message is sent
+        if hub._ignore.get(type(message), 0) > 0:
+            return
+        # By identity, since component ids overload `==`
+        key = (
+            type(message),
+            id(message.sender),
+            id(getattr(message, "data", None)),
+            id(getattr(message, "attribute", None)),
+        )
+        messages[key] = message
+
+    hub.broadcast = defer
+    try:
+        yield
+    finally:
+        del hub.broadcast
+        del _DEFERRED[hub]
+        for message in messages.values():
+            hub.broadcast(message)
+
+
 class GlobalState(BaseState):
+    TRACK_CHANGES = True
+
     drawer: bool = True
     speed_menu: bool = False
     loading_status_message: str = ""
@@ -62,15 +224,17 @@ class GlobalState(BaseState):
     allow_advancing: bool = True
     speech: Speech = Speech()
 
-    @cached_property
+    # The glue app belongs to the session, not to this model, which may be
+    # shared between sessions and outlives them; see `cosmicds.glue_apps`
+    @property
     def _glue_app(self) -> JupyterApplication:
-        return JupyterApplication()
+        return get_glue_app()
 
-    @cached_property
+    @property
     def glue_data_collection(self) -> DataCollection:
         return self._glue_app.data_collection
 
-    @cached_property
+    @property
     def glue_session(self) -> Session:
         return self._glue_app.session
     
@@ -83,5 +247,19 @@ class GlobalState(BaseState):
             self.glue_data_collection.append(data)
             return data
 
+    def batch_data_updates(self):
+        """
+        Context manager under which data updates form a single transaction:
+        their hub messages are deferred and de-duplicated until it exits, so
+        that each listener refreshes once rather than once per update.
+        """
+        return deferred_messages(self.glue_session.hub)
+
+    def add_or_update_datasets(self, datasets: Iterable[Data]) -> list[Data]:
+        """Like `add_or_update_data`, for many datasets at once, with one
+        round of hub messages for the whole lot."""
+        with self.batch_data_updates():
+            return [self.add_or_update_data(data) for data in datasets]
+
 
 GLOBAL_STATE = solara.reactive(GlobalState())
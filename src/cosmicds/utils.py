@@ -56,6 +56,30 @@ def get_session_id() -> str:
     return context.session_id
 
 
+def get_kernel_context():
+    """Returns the Solara kernel context of the current session, or `None`
+    when not running inside a kernel (e.g. in scripts and tests)."""
+    import solara.server.kernel_context
+
+    try:
+        return solara.server.kernel_context.get_current_context()
+    except Exception:
+        return None
+
+
+def get_kernel_id() -> str | None:
+    """
+    Returns the id of the current session's kernel, or `None` outside of a
+    kernel.
+
+    Per-session state is keyed by kernel rather than by session cookie,
+    since every browser tab has a kernel (and state) of its own but shares
+    the cookie with the others.
+    """
+    context = get_kernel_context()
+    return context.id if context is not None else None
+
+
 # JC: I got parts of this from https://stackoverflow.com/a/57915246
 class CDSJSONEncoder(json.JSONEncoder):
     def default(self, obj):
@@ -468,6 +492,12 @@ def combine_css(**kwargs):
     return css
 
 
+# Whether `LoggingAdapter` echoes requests to the browser console. Only meant
+# for debugging: every message is a round trip to the frontend. Request
+# metrics are kept server-side by `cosmicds.metrics` either way.
+CONSOLE_LOGGING = os.getenv("CDS_CONSOLE_LOG", "").lower() == "true"
+
+
 def log_to_console(msg, css="color:white;"):
     display(Javascript(f'console.log("%c{msg}", "{css}");'))
 
@@ -475,8 +505,9 @@ def log_to_console(msg, css="color:white;"):
 class LoggingAdapter(adapters.HTTPAdapter):
     # https://requests.readthedocs.io/en/latest/user/advanced.html?#transport-adapters
     # https://requests.readthedocs.io/en/latest/user/advanced.html?#event-hooks
-    def __init__(self, log_prefix=None, *args, **kwargs):
+    def __init__(self, log_prefix=None, *args, console=None, **kwargs):
         self._log_prefix = log_prefix or str(random.randint(100, 999))
+        self.console = CONSOLE_LOGGING if console is None else console
         super().__init__(*args, **kwargs)
 
     def set_prefix(self, prefix):
@@ -501,7 +532,8 @@ class LoggingAdapter(adapters.HTTPAdapter):
         css = combine_css(color="royalblue")
 
         self.on_send(request)
-        log_to_console(msg, css=css)
+        if self.console:
+            log_to_console(msg, css=css)
         return super().send(request, *args, **kwargs)
 
     def build_response(self, req, resp):
@@ -522,7 +554,8 @@ class LoggingAdapter(adapters.HTTPAdapter):
         )
 
         self.on_response(response)
-        log_to_console(msg, css=css)
+        if self.console:
+            log_to_console(msg, css=css)
         return response
 
     @staticmethod
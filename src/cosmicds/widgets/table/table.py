@@ -7,15 +7,40 @@ from glue.core.message import (
     SubsetUpdateMessage,
 )
 from glue.core import HubListener
-from glue.core.subset import SubsetState
+from glue.core.subset import CategorySubsetState, MultiOrState, SubsetState
 from ipyvuetify import VuetifyTemplate
-from traitlets import Bool, Dict, List, Unicode, observe
+from traitlets import Bool, Dict, Int, List, Unicode, observe
 
 from ...utils import convert_material_color, load_template
 
 __all__ = ["Table"]
 
 _DEFAULT_TRANSFORM = lambda x: x
+_ACCEPT_ALL = lambda item: True
+
+
+def _argsort(values: list) -> np.ndarray:
+    """Positions of ``values`` in ascending order, with `None` last."""
+    array = np.asarray(values)
+    if array.dtype != object:
+        return np.argsort(array, kind="stable")
+
+    positions = range(len(values))
+    try:
+        order = sorted(positions, key=lambda i: (values[i] is None, values[i]))
+    except TypeError:
+        # Mixed types; compare them as text
+        order = sorted(positions, key=lambda i: (values[i] is None, str(values[i])))
+    return np.array(order, dtype=np.intp)
+
+
+def _same_value(a, b) -> bool:
+    # NaN never equals itself, but is the same value for display
+    return a == b or (a != a and b != b)
+
+
+def _same_row(a: dict, b: dict) -> bool:
+    return a.keys() == b.keys() and all(_same_value(a[key], b[key]) for key in a)
 
 
 class Table(VuetifyTemplate, HubListener):
@@ -36,6 +61,15 @@ class Table(VuetifyTemplate, HubListener):
     use_search = Bool(False).tag(sync=True)
     allow_row_click = Bool(True).tag(sync=True)
 
+    # Server-side mode: `items` holds only a window of the sorted and
+    # searched rows, starting at row `window_start`, around the current page
+    server_side = Bool(False).tag(sync=True)
+    page = Int(1).tag(sync=True)
+    items_per_page = Int(10).tag(sync=True)
+    server_items_length = Int(-1).tag(sync=True)
+    window_start = Int(0).tag(sync=True)
+    sort_desc = Bool(False).tag(sync=True)
+
     def __init__(self, session, data, tools=None, item_filter=None, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
@@ -62,7 +96,7 @@ class Table(VuetifyTemplate, HubListener):
                 del tool["activate"]
                 self.tools = {tool_id: tool, **self.tools}
 
-        self.item_filter = item_filter or (lambda item: True)
+        self.item_filter = item_filter or _ACCEPT_ALL
 
         self.subset_color = kwargs.get("color", Table.default_color)
         self.use_subset_group = kwargs.get("use_subset_group", True)
@@ -104,6 +138,26 @@ class Table(VuetifyTemplate, HubListener):
 
         self._row_click_callback = None
 
+        # The rows last sent, by key, and whether the browser's copy of
+        # `items` has fallen behind the rows it shows because of patches
+        self._store = {}
+        self._patched = False
+        self._row_of_key = None
+        self._selected_keys = set()
+
+        # With a page size, only the current page and `window_margin` pages
+        # either side of it are sent to the browser
+        self._all_items = []
+        self._views = {}
+        self._sort_indexes = {}
+        self._texts = None
+        self._sort_field = None
+        self.window_margin = kwargs.get("window_margin", 1)
+        page_size = kwargs.get("page_size", None)
+        if page_size:
+            self.items_per_page = page_size
+            self.server_side = True
+
         # Populate the table with the current data in the collection
         self._populate_table()
 
@@ -177,23 +231,38 @@ class Table(VuetifyTemplate, HubListener):
 
     def subset_state_from_selected(self, selected):
         keys = [x[self.key_component] for x in selected]
-        if keys:
-            state = np.bitwise_or.reduce(
-                [self._glue_data.id[self.key_component] == x for x in keys]
-            )
-        else:
-            state = SubsetState()
-        return state
+        if not keys:
+            return SubsetState()
+
+        # Select by key value rather than by row, so that the selection
+        # carries over to linked datasets in a subset group
+        key_id = self._glue_data.id[self.key_component]
+        if self._glue_data.get_kind(key_id) == "numerical":
+            return CategorySubsetState(key_id, keys)
+
+        # Category codes differ between datasets, so compare labels
+        return MultiOrState([key_id == key for key in keys])
 
     def _selection_from_state(self, state):
         mask = state.to_mask(self._glue_data)
-        return [item for index, item in enumerate(self.items) if mask[index]]
+        shown = np.flatnonzero(mask[self._rows])
+        return [self._all_items[position] for position in shown]
 
     def _transform(self, component):
         return self._transforms.get(component, _DEFAULT_TRANSFORM)
 
+    def _columns(self) -> dict[str, list]:
+        """The table's components, transformed, as lists of plain values."""
+        columns = {}
+        for component in self._glue_components:
+            values = np.asarray(self._glue_data[component]).tolist()
+            transform = self._transform(component)
+            if transform is not _DEFAULT_TRANSFORM:
+                values = list(map(transform, values))
+            columns[component] = values
+        return columns
+
     def _populate_table(self):
-        df = self._glue_data.to_dataframe()
         self.headers = [
             {"text": name, "value": component}
             for name, component in zip(
@@ -201,17 +270,189 @@ class Table(VuetifyTemplate, HubListener):
             )
         ]
         self.headers[0]["align"] = "start"
-        self.items = [
-            item
-            for _, row in df.iterrows()
-            if self.item_filter(
-                item := {
-                    component: self._transform(component)(row[component])
-                    for component in self._glue_components
-                }
+
+        columns = self._columns()
+        items = [dict(zip(columns, values)) for values in zip(*columns.values())]
+
+        # The data row of each key; only usable if keys are unique
+        keys = columns[self.key_component]
+        self._row_of_key = {key: row for row, key in enumerate(keys)}
+        if len(self._row_of_key) != len(keys):
+            self._row_of_key = None
+
+        # The data rows shown, in order, so that items can be matched to masks
+        if self.item_filter is _ACCEPT_ALL:
+            self._rows = np.arange(len(items))
+        else:
+            mask = np.fromiter(map(self.item_filter, items), dtype=bool, count=len(items))
+            self._rows = np.flatnonzero(mask)
+            items = [items[row] for row in self._rows]
+
+        self._all_items = items
+        self._views = {}
+        self._sort_indexes = {}
+        self._texts = None
+        self._refresh_window()
+
+    def _sort_index(self, field: str) -> np.ndarray:
+        """Positions of the rows in ascending order of ``field``, cached
+        until the rows change."""
+        order = self._sort_indexes.get(field)
+        if order is None:
+            order = _argsort([item[field] for item in self._all_items])
+            self._sort_indexes[field] = order
+        return order
+
+    def _text_index(self) -> np.ndarray:
+        """The searchable text of each row, cached until the rows change.
+        Like Vuetify's default filter, this is every value but booleans and
+        `None`, in lower case."""
+        if self._texts is None:
+            self._texts = np.array(
+                [
+                    # Searches are single lines, so matches can't span values
+                    "\n".join(
+                        str(value).lower()
+                        for value in item.values()
+                        if value is not None and not isinstance(value, bool)
+                    )
+                    for item in self._all_items
+                ],
+                dtype=str,
             )
+        return self._texts
+
+    def _view(self) -> np.ndarray:
+        """Positions of the rows in the order shown, after searching and
+        sorting, cached by search and sort state until the rows change."""
+        search = (self.search or "").lower()
+        key = (search, self._sort_field, self.sort_desc)
+        view = self._views.get(key)
+        if view is not None:
+            return view
+
+        if self._sort_field is None:
+            view = np.arange(len(self._all_items))
+        else:
+            view = self._sort_index(self._sort_field)
+            if self.sort_desc:
+                view = view[::-1]
+
+        if search:
+            matches = np.char.find(self._text_index(), search) >= 0
+            view = view[matches[view]]
+
+        self._views[key] = view
+        return view
+
+    def _refresh_window(self):
+        if not self.server_side:
+            self._set_items(self._all_items)
+            return
+
+        view = self._view()
+        # The footer's "All" option asks for -1 rows per page
+        per_page = self.items_per_page if self.items_per_page > 0 else max(len(view), 1)
+        pages = max(1, -(-len(view) // per_page))
+        page = min(max(self.page, 1), pages)
+        if page != self.page:
+            # Which refreshes again, through `_on_view_changed`
+            self.page = page
+            return
+
+        start = max(0, (page - 1 - self.window_margin) * per_page)
+        end = (page + self.window_margin) * per_page
+
+        with self.hold_sync():
+            self.server_items_length = len(view)
+            self.window_start = start
+            self._set_items([self._all_items[position] for position in view[start:end]])
+
+    @observe("page", "items_per_page", "search", "sort_desc")
+    def _on_view_changed(self, change):
+        if not self.server_side or change["new"] == change["old"]:
+            return
+
+        # A new search starts from the first page, as it does client-side
+        if change["name"] == "search" and self.page != 1:
+            self.page = 1
+        else:
+            self._refresh_window()
+
+    def _set_items(self, items):
+        """
+        Sets `items`. When only some rows changed, the browser is sent just
+        those, as a patch to the rows it shows, and the trait is updated
+        here without being synced.
+        """
+        store = {item[self.key_component]: item for item in items}
+        if len(store) != len(items):
+            # Rows with the same key can't be told apart
+            store = {}
+
+        patch = self._diff(self._store, store)
+        self._store = store
+
+        if patch is None:
+            self._send_items(items)
+            return
+
+        if any(patch.values()):
+            with self._lock_property(items=items):
+                self.items = items
+            self.send({"method": "patch_items", "args": [patch]})
+            self._patched = True
+
+    def _send_items(self, items):
+        if not self._patched:
+            self.items = items
+            return
+
+        # The browser's `items` may be stale, so this might not be a change
+        # from its point of view: send the state regardless
+        with self._lock_property(items=items):
+            self.items = items
+        self.send_state("items")
+        self.send({"method": "reset_rows"})
+        self._patched = False
+
+    @staticmethod
+    def _diff(old: dict, new: dict) -> dict | None:
+        """
+        The rows removed (by key), updated and inserted (with their
+        positions) going from ``old`` to ``new``, or `None` if it would be
+        cheaper to send every row, including when rows were reordered.
+        """
+        if not old:
+            return None
+
+        kept = [key for key in old if key in new]
+        if kept != [key for key in new if key in old]:
+            return None
+
+        remove = [key for key in old if key not in new]
+        update = [
+            item
+            for key, item in new.items()
+            if key in old and not _same_row(old[key], item)
+        ]
+        insert = [
+            [index, item]
+            for index, (key, item) in enumerate(new.items())
+            if key not in old
         ]
 
+        # Removals cost only a key each, so a window that moved by a page
+        # still makes for a patch much smaller than the rows it holds
+        if len(update) + len(insert) + len(remove) // 4 >= len(new):
+            return None
+        return {"remove": remove, "update": update, "insert": insert}
+
+    def vue_refresh_rows(self, _args=None):
+        # A view created after patches starts from the stale `items`
+        if self._patched:
+            self._send_items(self.items)
+
     def _new_subset(self):
         state = self.subset_state_from_selected(self.selected)
         if self.use_subset_group:
@@ -230,7 +471,7 @@ class Table(VuetifyTemplate, HubListener):
         self._populate_table()
 
     def filter_by(self, item_filter):
-        self.item_filter = item_filter or (lambda item: True)
+        self.item_filter = item_filter or _ACCEPT_ALL
         self._populate_table()
 
     def _on_subset_updated(self, message=None):
@@ -244,6 +485,7 @@ class Table(VuetifyTemplate, HubListener):
     def _on_data_deleted(self):
         self.data_collection.remove_subset_group(self._subset)
         self.subset = None
+        self._store = {}
         self.items = {}
 
     def _on_data_collection_delete(self, message=None):
@@ -259,6 +501,7 @@ class Table(VuetifyTemplate, HubListener):
 
     @observe("selected")
     def _on_selected_changed(self, event):
+        self._selected_keys = {item[self.key_component] for item in event["new"]}
         self.update_subset(event["new"])
 
     @property
@@ -270,9 +513,14 @@ class Table(VuetifyTemplate, HubListener):
             self.subset = self._new_subset()
 
     def indices_from_items(self, items):
+        if self._row_of_key is not None:
+            rows = {self._row_of_key.get(item[self.key_component]) for item in items}
+            rows.discard(None)
+            return sorted(rows)
+
         state = self.subset_state_from_selected(items)
         mask = state.to_mask(self.glue_data)
-        return [index for index in range(len(mask)) if mask[index]]
+        return np.flatnonzero(mask).tolist()
 
     @property
     def indices(self):
@@ -303,7 +551,7 @@ class Table(VuetifyTemplate, HubListener):
 
         # We can't just use append/remove here
         # We need a reassignment so that the watcher is triggered
-        elif key in self.selected_keys:
+        elif key in self._selected_keys:
             self.selected = [x for x in self.selected if x[self.key_component] != key]
         else:
             self.selected = self.selected + [item]
@@ -313,6 +561,9 @@ class Table(VuetifyTemplate, HubListener):
         # which is empty is there isn't a sort field selected
         # We default to the key component
         self.sort_by = field[0] if len(field) > 0 else self.key_component
+        self._sort_field = field[0] if len(field) > 0 else None
+        if self.server_side:
+            self._refresh_window()
 
     def update_tool(self, tool):
         self.send({"method": "update_tool", "args": [tool]})
@@ -1,10 +1,81 @@
-"""
-    Dummy conftest.py for cosmicds.
+import httpx
+import pytest
 
-    If you don't know what this is for, just leave it empty.
-    Read more about conftest.py under:
-    - https://docs.pytest.org/en/stable/fixture.html
-    - https://docs.pytest.org/en/stable/writing_plugins.html
-"""
+from cosmicds.metrics import APIMetrics
+from cosmicds.remote import APIClient, AsyncBaseAPI
+from cosmicds.stand_in import StandInAPI
 
-# import pytest
+
+class FlakyTransport(httpx.AsyncBaseTransport):
+    """
+    Passes requests on to ``transport``, except that the next ``failures``
+    requests other than GETs are answered with ``status`` instead.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self.transport = transport
+        self.failures = 0
+        self.status = 503
+        self.methods = []
+        self.requests = []
+
+    async def handle_async_request(self, request):
+        self.methods.append(request.method)
+        self.requests.append(request)
+        if request.method != "GET" and self.failures > 0:
+            self.failures -= 1
+            return httpx.Response(self.status, request=request)
+        return await self.transport.handle_async_request(request)
+
+
+@pytest.fixture
+def stand_in():
+    return StandInAPI()
+
+
+@pytest.fixture
+def transport(stand_in):
+    return FlakyTransport(stand_in.transport)
+
+
+@pytest.fixture
+def make_api(transport, tmp_path, monkeypatch):
+    """Makes an `AsyncBaseAPI` talking to the stand-in, with or without a
+    journal of its own."""
+    monkeypatch.setenv("CDS_JOURNAL_PATH", str(tmp_path / "journal.sqlite"))
+    apis = []
+
+    def make_api(journal: bool = False) -> AsyncBaseAPI:
+        client = APIClient(transport=transport)
+        api = AsyncBaseAPI(client=client, api_url="http://stand-in", metrics=APIMetrics())
+        apis.append(api)
+        api.JOURNAL = journal
+        api.writes.delay = api.writes.max_delay = 0.01
+        api.writes.RETRY_BACKOFF = 0.01
+        return api
+
+    yield make_api
+
+    for api in apis:
+        api.writes.close()
+        api.client.close()
+
+
+@pytest.fixture
+def api(make_api):
+    return make_api()
+
+
+@pytest.fixture
+def base_api(api, monkeypatch):
+    """A `BaseAPI` over ``api``, as seen from inside a kernel whose user is
+    logged in."""
+    from cosmicds import remote
+
+    monkeypatch.setattr(remote, "get_kernel_id", lambda: "kernel")
+    monkeypatch.setattr(remote.BaseAPI, "_hash_user", staticmethod(lambda: "hashed-user"))
+    monkeypatch.setattr(remote.BaseAPI, "_identities", {})
+
+    base_api = remote.BaseAPI()
+    base_api.aio = api
+    return base_api
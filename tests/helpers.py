@@ -0,0 +1,15 @@
+import time
+
+
+def wait_for(condition, timeout=5.0):
+    """Waits until ``condition()`` is true, failing after ``timeout`` seconds."""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def document(stand_in, path):
+    """The state the stand-in holds at ``path``, if any."""
+    entry = stand_in._documents.get(path)
+    return entry.state if entry is not None else None
@@ -0,0 +1,85 @@
+import httpx
+import pytest
+
+STORY = {"story": {"title": "story"}}
+STAGES = {"1": {"step": 1}, "2": {"step": 2}}
+
+
+@pytest.fixture
+def story_api(api, transport):
+    """``api``, with a story state and the states of stages 1 and 2 stored."""
+    api.client.run(
+        api._write_state(api.story_state_path(1, "story"), api.codec.encode(STORY))
+    )
+    for stage_id, state in STAGES.items():
+        api.client.run(
+            api._write_state(
+                api.stage_state_path(1, "story", stage_id), api.codec.encode(state)
+            )
+        )
+
+    # Start from a cold client, as a new session would
+    api.cache.clear()
+    api.baselines.clear()
+    api.validators.clear()
+    transport.requests.clear()
+    return api
+
+
+def paths(transport):
+    return sorted(request.url.path for request in transport.requests)
+
+
+def test_story_is_loaded_concurrently_without_batch_endpoint(story_api, transport):
+    story, stages = story_api.client.run(story_api.load_story(1, "story", ["1", "2", "3"]))
+
+    assert story == STORY
+    assert stages == {**STAGES, "3": None}
+    assert paths(transport) == [
+        "/stage-state/1/story/1",
+        "/stage-state/1/story/2",
+        "/stage-state/1/story/3",
+        "/story-state/1/story",
+    ]
+
+
+def test_story_is_loaded_in_one_request_with_batch_endpoint(story_api, transport):
+    story_api.BATCH_BOOTSTRAP = True
+
+    story, stages = story_api.client.run(story_api.load_story(1, "story", ["1", "2", "3"]))
+
+    assert story == STORY
+    assert stages == {**STAGES, "3": None}
+    assert paths(transport) == ["/story-bootstrap/1/story"]
+
+    # The batch response counts as the baseline for later writes
+    transport.methods.clear()
+    story_api.client.run(
+        story_api._write_state(
+            story_api.stage_state_path(1, "story", "1"), story_api.codec.encode({"step": 3})
+        )
+    )
+    assert transport.methods == ["PATCH"]
+
+
+def test_failed_batch_load_falls_back(story_api, transport, monkeypatch):
+    story_api.BATCH_BOOTSTRAP = True
+
+    async def fail(*args):
+        raise httpx.ConnectError("No route")
+
+    monkeypatch.setattr(story_api, "_load_story_batch", fail)
+
+    story, stages = story_api.client.run(story_api.load_story(1, "story", ["1"]))
+
+    assert (story, stages) == (STORY, {"1": STAGES["1"]})
+
+
+def test_queued_write_wins_over_batch_document(story_api):
+    story_api.BATCH_BOOTSTRAP = True
+    story_api.writes.delay = story_api.writes.max_delay = 60
+    story_api.put_stage_state(1, "story", "1", {"step": 5})
+
+    _, stages = story_api.client.run(story_api.load_story(1, "story", ["1"]))
+
+    assert stages["1"] == {"step": 5}
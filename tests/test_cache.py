@@ -0,0 +1,90 @@
+import asyncio
+
+from cosmicds.cache import ResponseCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_entries_expire_after_their_ttl():
+    clock = FakeClock()
+    cache = ResponseCache(clock=clock)
+    cache.set("a", 1, ttl=10)
+
+    clock.now = 9.9
+    assert cache.get("a") == 1
+
+    clock.now = 10
+    assert cache.get("a") is None
+    assert "a" not in cache
+    assert cache.get("a", allow_stale=True) == 1
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResponseCache(maxsize=2)
+    cache.set("a", 1, ttl=10)
+    cache.set("b", 2, ttl=10)
+
+    # Reading "a" makes "b" the least recently used
+    assert cache.get("a") == 1
+    cache.set("c", 3, ttl=10)
+
+    assert len(cache) == 2
+    assert "a" in cache
+    assert "b" not in cache
+    assert "c" in cache
+
+
+def test_concurrent_loads_share_one_call():
+    cache = ResponseCache()
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return len(calls), 10
+
+    async def main():
+        return await asyncio.gather(*(cache.get_or_load("a", loader) for _ in range(5)))
+
+    assert asyncio.run(main()) == [1] * 5
+    assert len(calls) == 1
+    assert cache.get("a") == 1
+
+
+def test_cancelled_waiter_does_not_cancel_shared_load():
+    cache = ResponseCache()
+
+    async def loader():
+        await asyncio.sleep(0.01)
+        return "value", 10
+
+    async def main():
+        first = asyncio.ensure_future(cache.get_or_load("a", loader))
+        second = asyncio.ensure_future(cache.get_or_load("a", loader))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(main()) == "value"
+
+
+def test_values_with_no_ttl_are_not_cached():
+    cache = ResponseCache()
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        return "value", None
+
+    async def main():
+        await cache.get_or_load("a", loader)
+        await cache.get_or_load("a", loader)
+
+    asyncio.run(main())
+    assert len(calls) == 2
@@ -0,0 +1,69 @@
+import pytest
+from helpers import wait_for
+
+from cosmicds.class_size import ClassSizeService
+
+
+@pytest.fixture
+def service(api):
+    service = ClassSizeService(api, interval=0.01)
+    yield service
+
+    pollers = list(service._pollers.values())
+    with service._lock:
+        for class_id in list(service._pollers):
+            service._stop(class_id)
+    wait_for(lambda: all(poller.future.done() for poller in pollers))
+
+
+def test_subscribers_share_one_poller(api, service):
+    first, second = [], []
+
+    service.subscribe(0, first.append)
+    service.subscribe(0, second.append)
+    assert len(service._pollers) == 1
+
+    wait_for(lambda: first == [0] and second == [0])
+
+    # A new student joins the class
+    api.client.run(api.create_student("student", "0"))
+
+    wait_for(lambda: first == [0, 1] and second == [0, 1])
+    assert service.latest(0) == 1
+
+
+def test_known_size_is_sent_on_subscribe(service):
+    service.subscribe(0, lambda size: None)
+    wait_for(lambda: service.latest(0) == 0)
+
+    sizes = []
+    service.subscribe(0, sizes.append)
+    assert sizes == [0]
+
+
+def test_last_unsubscribe_stops_polling(service):
+    unsubscribe_first = service.subscribe(0, lambda size: None)
+    unsubscribe_second = service.subscribe(0, lambda size: None)
+    wait_for(lambda: service.latest(0) == 0)
+    poller = service._pollers[0]
+
+    unsubscribe_first()
+    assert service._pollers == {0: poller}
+
+    unsubscribe_second()
+    assert service._pollers == {}
+    assert service.latest(0) is None
+    wait_for(lambda: poller.future.done())
+
+
+def test_owner_subscriptions_are_dropped(service):
+    kept = []
+    service.subscribe(0, lambda size: None, owner="kernel-a")
+    service.subscribe(0, kept.append, owner="kernel-b")
+    wait_for(lambda: kept == [0])
+
+    service.unsubscribe_owner("kernel-a")
+    assert [owner for _, _, owner in service._subscribers[0].values()] == ["kernel-b"]
+
+    service.unsubscribe_owner("kernel-b")
+    assert service._pollers == {}
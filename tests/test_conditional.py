@@ -0,0 +1,60 @@
+from cosmicds.remote import NOT_MODIFIED
+
+
+def write(api, path, state):
+    api.client.run(api._write_state(path, api.codec.encode(state)))
+
+
+def test_revalidation_sends_etag_and_uses_304(make_api, transport):
+    api = make_api()
+    path = api.stage_state_path(1, "story", "stage")
+    write(make_api(), path, {"value": 1})
+
+    state, tag = api.client.run(api.get_state_document(path))
+    assert state == {"value": 1}
+    assert tag == '"1"'
+
+    transport.requests.clear()
+    state, _ = api.client.run(api.get_state_document(path))
+
+    assert state == {"value": 1}
+    assert transport.requests[-1].headers["If-None-Match"] == '"1"'
+    assert api.metrics.responses["stage-state", "GET", "304"] == 1
+
+
+def test_known_tag_gives_not_modified(make_api):
+    api = make_api()
+    path = api.stage_state_path(1, "story", "stage")
+    write(make_api(), path, {"value": 1})
+
+    _, tag = api.client.run(api.get_state_document(path))
+    state, same_tag = api.client.run(api.get_state_document(path, known_tag=tag))
+
+    assert state is NOT_MODIFIED
+    assert same_tag == tag
+
+
+def test_changed_document_is_returned_despite_known_tag(make_api):
+    api = make_api()
+    other = make_api()
+    path = api.stage_state_path(1, "story", "stage")
+    write(other, path, {"value": 1})
+
+    _, tag = api.client.run(api.get_state_document(path))
+    write(other, path, {"value": 2})
+    state, new_tag = api.client.run(api.get_state_document(path, known_tag=tag))
+
+    assert state == {"value": 2}
+    assert new_tag != tag
+
+
+def test_returned_state_is_a_copy(make_api):
+    api = make_api()
+    path = api.stage_state_path(1, "story", "stage")
+    write(make_api(), path, {"value": [1]})
+
+    state, _ = api.client.run(api.get_state_document(path))
+    state["value"].append(2)
+
+    state, _ = api.client.run(api.get_state_document(path))
+    assert state == {"value": [1]}
@@ -0,0 +1,72 @@
+import json
+
+import pytest
+
+from cosmicds import delta
+
+DOCUMENTS = [
+    ({}, {"a": 1}),
+    ({"a": 1, "b": 2}, {"a": 1}),
+    ({"a": {"b": [1, 2, 3]}}, {"a": {"b": [1, 5]}}),
+    ({"a": [1]}, {"a": [1, {"c": None}, 3]}),
+    ({"a/b": 1, "c~d": 2}, {"a/b": 3, "c~d": 2, "e~/f": 4}),
+    ({"a": 1}, {"a": "1"}),
+    ({"a": True}, {"a": 1}),
+    ([1, 2], {"a": 1}),
+]
+
+
+@pytest.mark.parametrize("old, new", DOCUMENTS)
+def test_apply_reverses_diff(old, new):
+    original = json.loads(json.dumps(old))
+    assert delta.apply(old, delta.diff(old, new)) == new
+    assert old == original
+
+
+def test_equal_documents_have_no_diff():
+    assert delta.diff({"a": [1, {"b": 2}]}, {"a": [1, {"b": 2}]}) == []
+
+
+def test_diff_touches_only_changed_values():
+    ops = delta.diff({"a": 1, "b": {"c": 2, "d": 3}}, {"a": 1, "b": {"c": 2, "d": 4}})
+    assert ops == [{"op": "replace", "path": "/b/d", "value": 4}]
+
+
+def test_stale_patch_falls_back_to_put(make_api, transport, stand_in):
+    api = make_api()
+    other = make_api()
+    path = api.stage_state_path(1, "story", "stage")
+
+    api.client.run(api._write_state(path, api.codec.encode({"a": 1, "b": 1})))
+
+    # Someone else moves the document on, so our baseline is out of date
+    other.client.run(other._write_state(path, other.codec.encode({"a": 2, "b": 1})))
+
+    transport.methods.clear()
+    api.client.run(api._write_state(path, api.codec.encode({"a": 1, "b": 3})))
+
+    assert transport.methods == ["PATCH", "PUT"]
+    assert api.metrics.responses["stage-state", "PATCH", "412"] == 1
+    assert stand_in._documents[path].state == {"a": 1, "b": 3}
+
+    # Our baseline is up to date again, so the next write is a patch
+    transport.methods.clear()
+    api.client.run(api._write_state(path, api.codec.encode({"a": 1, "b": 4})))
+    assert transport.methods == ["PATCH"]
+    assert stand_in._documents[path].state == {"a": 1, "b": 4}
+
+
+def test_unchanged_write_over_stale_baseline_is_sent(make_api, transport, stand_in):
+    api = make_api()
+    other = make_api()
+    path = api.stage_state_path(1, "story", "stage")
+
+    api.client.run(api._write_state(path, api.codec.encode({"a": 1})))
+    other.client.run(other._write_state(path, other.codec.encode({"a": 2})))
+
+    # Same as our baseline, but not as the server's document
+    transport.methods.clear()
+    api.client.run(api._write_state(path, api.codec.encode({"a": 1})))
+
+    assert transport.methods == ["PATCH", "PUT"]
+    assert stand_in._documents[path].state == {"a": 1}
@@ -0,0 +1,74 @@
+import numpy as np
+from pydantic import BaseModel, ConfigDict, field_validator
+
+from cosmicds.hydration import construct, hydrate
+
+
+class Inner(BaseModel):
+    x: int = 0
+    tags: list[str] = []
+
+
+class Outer(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    name: str = ""
+    inner: Inner = Inner()
+    maybe: Inner | None = None
+    point: tuple[int, int] = (0, 0)
+    array: np.ndarray | None = None
+
+    @field_validator("point")
+    @classmethod
+    def _scale(cls, value):
+        return (value[0] * 10, value[1])
+
+    @field_validator("array", mode="before")
+    @classmethod
+    def _to_array(cls, value):
+        return None if value is None else np.asarray(value)
+
+
+def test_construct_builds_nested_models():
+    model = construct(Outer, {"name": "a", "inner": {"x": 1}, "maybe": {"tags": ["t"]}})
+
+    assert model == Outer(name="a", inner=Inner(x=1), maybe=Inner(tags=["t"]))
+    assert isinstance(model.maybe, Inner)
+
+
+def test_validated_fields_use_model_config_and_validators():
+    model = construct(Outer, {"point": [1, 2], "array": [1, 2, 3]})
+
+    assert model.point == (10, 2)
+    assert isinstance(model.array, np.ndarray)
+    assert model.array.tolist() == [1, 2, 3]
+
+
+def test_hydrate_touches_only_changed_fields():
+    model = construct(Outer, {"name": "a", "inner": {"x": 1}, "maybe": {"x": 2}})
+    inner = model.inner
+    maybe = model.maybe
+
+    changed = hydrate(model, {"name": "a", "inner": {"x": 1}, "maybe": {"x": 3}})
+
+    assert changed == {"maybe"}
+    assert model.inner is inner
+    assert model.maybe.x == 3
+    # Nested models are replaced rather than modified, since they may be shared
+    assert maybe.x == 2
+
+
+def test_hydrate_keeps_fields_missing_from_data():
+    model = construct(Outer, {"name": "a", "inner": {"x": 1}})
+
+    assert hydrate(model, {"name": "b"}) == {"name"}
+    assert model.name == "b"
+    assert model.inner.x == 1
+
+
+def test_hydrate_handles_array_fields():
+    model = construct(Outer, {"array": [1, 2]})
+
+    assert hydrate(model, {"array": [1, 3], "point": [2, 0]}) == {"array", "point"}
+    assert model.array.tolist() == [1, 3]
+    assert model.point == (20, 0)
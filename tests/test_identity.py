@@ -0,0 +1,56 @@
+import solara
+
+from cosmicds.remote import BaseAPI
+from cosmicds.state import GlobalState
+
+
+def test_identity_is_memoized_per_session(base_api):
+    identity = base_api.identity
+
+    assert identity.hashed_user == "hashed-user"
+    assert base_api.identity is identity
+    assert base_api.hashed_user == "hashed-user"
+
+
+def test_bootstrap_fills_identity(base_api):
+    state = solara.reactive(GlobalState())
+
+    assert base_api.bootstrap_user("story", "0", state)
+
+    identity = base_api.identity
+    assert identity.student_id == state.value.student.id == 1
+    assert identity.class_info == state.value.classroom.class_info == {"id": 0, "code": "0"}
+    assert state.value.classroom.size == 1
+
+
+def test_known_user_is_not_looked_up_again(base_api, stand_in):
+    base_api.bootstrap_user("story", "0", solara.reactive(GlobalState()))
+    requests = stand_in.requests.copy()
+
+    state = solara.reactive(GlobalState())
+    assert base_api.bootstrap_user("story", "", state)
+    base_api.load_user_info("story", state)
+
+    assert state.value.student.id == 1
+    assert state.value.classroom.class_info == {"id": 0, "code": "0"}
+    assert state.value.classroom.size == 1
+    assert stand_in.requests["student"] == requests["student"]
+    assert stand_in.requests["class-for-student-story"] == requests["class-for-student-story"]
+
+
+def test_other_story_is_looked_up(base_api, stand_in):
+    base_api.bootstrap_user("story", "0", solara.reactive(GlobalState()))
+    lookups = stand_in.requests["class-for-student-story"]
+
+    assert base_api.bootstrap_user("other", "", solara.reactive(GlobalState()))
+    assert stand_in.requests["class-for-student-story"] == lookups + 1
+
+
+def test_clear_user_forgets_identity(base_api):
+    state = solara.reactive(GlobalState())
+    base_api.bootstrap_user("story", "0", state)
+
+    BaseAPI.clear_user(state)
+
+    assert state.value.student.id == 0
+    assert base_api.identity.student_id is None
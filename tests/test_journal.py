@@ -0,0 +1,47 @@
+import time
+
+from helpers import document, wait_for
+
+
+def test_failed_write_is_replayed_from_journal(make_api, transport, stand_in):
+    api = make_api(journal=True)
+    transport.failures = 2
+    path = api.stage_state_path(1, "story", "stage")
+
+    api.put_stage_state(1, "story", "stage", {"value": 1})
+
+    wait_for(lambda: document(stand_in, path) == {"value": 1})
+    wait_for(lambda: not api.journal.pending())
+
+
+def test_journaled_writes_are_replayed_on_restart(make_api, transport, stand_in):
+    api = make_api(journal=True)
+    path = api.stage_state_path(1, "story", "stage")
+    url = f"{api.API_URL}{path}"
+
+    # As left behind by a previous run that never got to send it
+    api.journal.record(url, api.codec.encode({"value": 1}))
+
+    restarted = make_api(journal=True)
+    wait_for(lambda: document(stand_in, path) == {"value": 1})
+    wait_for(lambda: not restarted.journal.pending())
+
+
+def test_replay_does_not_overwrite_newer_write(make_api, stand_in):
+    api = make_api(journal=True)
+    paths = [api.stage_state_path(1, "story", stage) for stage in ("a", "b")]
+    for path, value in zip(paths, ("old-a", "old-b")):
+        api.journal.record(f"{api.API_URL}{path}", api.codec.encode({"v": value}))
+
+    stand_in.latency = 0.3
+    restarted = make_api(journal=True)
+
+    # While "a" is being replayed, a newer "b" is written
+    wait_for(lambda: stand_in.requests["stage-state"] > 0)
+    restarted.put_stage_state(1, "story", "b", {"v": "NEW-b"})
+    restarted.writes.flush(wait=True)
+
+    wait_for(lambda: not restarted.journal.pending())
+    time.sleep(0.5)
+    assert document(stand_in, paths[0]) == {"v": "old-a"}
+    assert document(stand_in, paths[1]) == {"v": "NEW-b"}
@@ -0,0 +1,40 @@
+import asyncio
+import hashlib
+
+from cosmicds.loadtest import LatencyRecorder, run_load, run_session
+from cosmicds.stand_in import StandInAPI
+
+
+def test_load_run_reports_every_operation():
+    report = asyncio.run(
+        run_load(sessions=3, stages=["1", "2"], writes_per_stage=2, think_time=0)
+    )
+
+    operations = report["operations"]
+    assert set(operations) == {"login", "story-state", "stage-state", "stage-write", "stage-revisit"}
+    assert operations["stage-write"]["count"] == 6
+    assert not any(stats["errors"] for stats in operations.values())
+    assert report["requests"] > 0
+
+
+def test_failed_login_is_counted():
+    report = asyncio.run(
+        run_load(sessions=2, stages=["1"], class_code="404", stand_in=StandInAPI())
+    )
+
+    assert report["operations"]["login"]["errors"] == 2
+    assert "stage-state" not in report["operations"]
+
+
+def test_requeued_write_is_counted(api, transport):
+    api.writes.RETRY_BACKOFF = 60
+    recorder = LatencyRecorder()
+
+    # The student exists already, so only the stage write is sent with PUT
+    hashed_user = hashlib.sha1(b"cosmicds-loadtest-0").hexdigest()
+    api.client.run(api.create_student(hashed_user, "0"))
+    transport.failures = 1
+
+    asyncio.run(run_session(api, recorder, 0, "story", ["1"], 1, 0, "0"))
+
+    assert recorder.errors == {"stage-write": 1}
@@ -0,0 +1,122 @@
+import asyncio
+
+import httpx
+import pytest
+
+from cosmicds.policy import CircuitBreaker, CircuitOpenError, EndpointPolicy, RequestPolicy
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def open_breaker(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=clock)
+    breaker.record_failure()
+    breaker.record_failure()
+    return breaker
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=3, clock=FakeClock())
+
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.times_opened == 1
+    assert not breaker.allow()
+
+
+def test_half_open_breaker_lets_one_trial_through():
+    clock = FakeClock()
+    breaker = open_breaker(clock)
+
+    clock.now = 10
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+
+
+def test_failed_trial_reopens_breaker():
+    clock = FakeClock()
+    breaker = open_breaker(clock)
+
+    clock.now = 10
+    assert breaker.allow()
+    breaker.record_failure()
+
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.times_opened == 2
+    assert not breaker.allow()
+
+    clock.now = 20
+    assert breaker.allow()
+
+
+def half_open_policy():
+    policy = RequestPolicy({}, EndpointPolicy(failure_threshold=1, reset_timeout=0))
+    policy.breaker("endpoint").record_failure()
+    return policy
+
+
+async def never_responds(timeout):
+    await asyncio.sleep(10)
+
+
+async def fails_to_decode(timeout):
+    raise httpx.DecodingError("garbled")
+
+
+async def responds(timeout):
+    return httpx.Response(200)
+
+
+def test_cancelled_trial_releases_half_open_breaker():
+    policy = half_open_policy()
+
+    async def main():
+        trial = asyncio.ensure_future(policy.execute("endpoint", "GET", never_responds))
+        await asyncio.sleep(0)
+        trial.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await trial
+
+        return await policy.execute("endpoint", "GET", responds)
+
+    assert asyncio.run(main()).status_code == 200
+    assert policy.breaker("endpoint").state == CircuitBreaker.CLOSED
+
+
+def test_trial_failing_oddly_releases_half_open_breaker():
+    policy = half_open_policy()
+
+    async def main():
+        with pytest.raises(httpx.DecodingError):
+            await policy.execute("endpoint", "GET", fails_to_decode)
+
+        return await policy.execute("endpoint", "GET", responds)
+
+    assert asyncio.run(main()).status_code == 200
+
+
+def test_open_breaker_fails_fast():
+    policy = RequestPolicy({}, EndpointPolicy(failure_threshold=1, reset_timeout=60))
+    policy.breaker("endpoint").record_failure()
+
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(policy.execute("endpoint", "GET", responds))
@@ -0,0 +1,96 @@
+import numpy as np
+import pytest
+
+from cosmicds import serialization
+from cosmicds.remote import AsyncBaseAPI
+from cosmicds.serialization import (
+    JSON_CONTENT_TYPE,
+    codec_for_body,
+    codec_for_content_type,
+    compress,
+    decompress,
+    get_codec,
+    get_compression,
+)
+
+DOCUMENT = {"name": "stage", "values": list(range(500)), "nested": {"flag": True}}
+
+
+def test_unknown_codec_is_an_error():
+    with pytest.raises(ValueError):
+        get_codec("yaml")
+
+
+def test_missing_codec_falls_back_to_json(monkeypatch):
+    monkeypatch.setitem(serialization._CODECS, "msgpack", (serialization.MsgpackCodec, False))
+    assert get_codec("msgpack").content_type == JSON_CONTENT_TYPE
+
+
+def test_json_codec_round_trip():
+    codec = get_codec("json")
+    assert codec.decode(codec.encode({**DOCUMENT, "array": np.arange(3)})) == {
+        **DOCUMENT,
+        "array": [0, 1, 2],
+    }
+
+
+def test_msgpack_codec_round_trip():
+    pytest.importorskip("msgpack")
+    codec = get_codec("msgpack")
+    body = codec.encode({**DOCUMENT, "array": np.arange(3.0)})
+
+    assert codec_for_body(body) is codec
+    assert codec_for_content_type("application/msgpack; charset=binary") is codec
+    assert codec.decode(body) == {**DOCUMENT, "array": [0.0, 1.0, 2.0]}
+
+
+def test_json_bodies_are_recognized():
+    body = get_codec("json").encode(DOCUMENT)
+    assert codec_for_body(body).content_type == JSON_CONTENT_TYPE
+    assert codec_for_content_type(None).content_type == JSON_CONTENT_TYPE
+
+
+@pytest.mark.parametrize("encoding", [None, "identity", "gzip"])
+def test_compression_round_trip(encoding):
+    body = get_codec("json").encode(DOCUMENT)
+    assert decompress(compress(body, encoding), encoding) == body
+
+
+def test_unsupported_compression_falls_back(monkeypatch):
+    assert get_compression("GZIP") == "gzip"
+    assert get_compression("identity") is None
+    assert get_compression("brotli") is None
+
+    monkeypatch.setattr(serialization, "ZSTD_AVAILABLE", False)
+    assert get_compression("zstd") == "gzip"
+
+
+def test_compressed_write_round_trip(api, stand_in):
+    api.COMPRESSION = "gzip"
+    api.COMPRESS_MIN_SIZE = 0
+    path = api.stage_state_path(1, "story", "stage")
+
+    api.client.run(api._write_state(path, api.codec.encode(DOCUMENT)))
+
+    assert stand_in._documents[path].state == DOCUMENT
+    assert api.client.run(api.get_stage_state(1, "story", "stage")) == DOCUMENT
+
+
+def test_refused_encoding_falls_back_to_json(api, transport, stand_in):
+    api.COMPRESSION = "gzip"
+    api.COMPRESS_MIN_SIZE = 0
+    transport.failures = 1
+    transport.status = 415
+    path = api.stage_state_path(1, "story", "stage")
+
+    api.client.run(api._write_state(path, api.codec.encode(DOCUMENT)))
+
+    assert transport.methods == ["PUT", "PUT"]
+    assert api.COMPRESSION is None
+    assert api.codec.content_type == JSON_CONTENT_TYPE
+    assert stand_in._documents[path].state == DOCUMENT
+
+
+def test_unknown_api_codec_falls_back_to_json(monkeypatch, make_api):
+    monkeypatch.setattr(AsyncBaseAPI, "CODEC", "yaml")
+    assert make_api().codec.content_type == JSON_CONTENT_TYPE
@@ -0,0 +1,139 @@
+import solara
+from glue.core import Data, DataCollection, HubListener
+from glue.core.message import DataMessage, NumericalDataChangedMessage
+
+from cosmicds.state import GlobalState, TrackedModel, deferred_messages
+
+
+class Inner(TrackedModel):
+    TRACK_CHANGES = True
+
+    x: int = 0
+    y: int = 0
+
+
+class Outer(TrackedModel):
+    TRACK_CHANGES = True
+
+    name: str = ""
+    inner: Inner = Inner()
+
+
+class Untracked(TrackedModel):
+    name: str = ""
+
+
+def saved(model):
+    model.checkpoint()
+    return model
+
+
+def test_new_models_are_dirty_in_every_field():
+    assert Outer().dirty_fields == {"name", "inner"}
+    assert Outer.model_construct(name="a").dirty_fields == {"name", "inner"}
+    assert Untracked().dirty_fields == set()
+
+
+def test_replacing_a_model_counts_as_a_change():
+    state = solara.reactive(saved(Outer()))
+    state.set(Outer(name="b"))
+
+    assert state.value.is_dirty
+
+
+def test_assignment_and_copy_updates_are_tracked():
+    model = saved(Outer())
+
+    model.name = "a"
+    assert model.dirty_fields == {"name"}
+
+    copy = saved(Outer()).model_copy(update={"name": "b"})
+    assert copy.dirty_fields == {"name"}
+
+
+def test_nested_changes_count_towards_parent():
+    model = saved(Outer(inner=Inner()))
+    model.inner.y = 2
+
+    assert model.dirty_fields == {"inner"}
+    model.checkpoint()
+    assert not model.inner.is_dirty
+
+
+def test_dump_changes_holds_only_changed_fields():
+    model = saved(Outer(name="a", inner=Inner(x=1)))
+    model.inner.y = 2
+
+    assert model.dump_changes() == {"inner": {"y": 2}}
+
+    model.name = "b"
+    model.inner = Inner(x=5)
+    model.inner.checkpoint()
+    assert model.dump_changes() == {"name": "b", "inner": {"x": 5, "y": 0}}
+
+
+def test_equality_ignores_change_tracking():
+    assert saved(Outer(name="a")) == Outer(name="a")
+    assert Outer(name="a") != Outer(name="b")
+
+
+def test_global_state_tracks_changes():
+    state = saved(GlobalState())
+    assert not state.is_dirty
+
+    assert state.model_copy(update={"drawer": False}).dirty_fields == {"drawer"}
+
+
+class _Listener(HubListener):
+    """Records the data messages broadcast to a hub."""
+
+    def __init__(self, hub):
+        self.received = []
+        hub.subscribe(self, DataMessage, handler=self.received.append)
+
+
+def test_deferred_messages_are_delivered_once_on_exit():
+    data_collection = DataCollection()
+    hub = data_collection.hub
+    first, second = Data(x=[1], label="first"), Data(x=[2], label="second")
+    data_collection.extend([first, second])
+    listener = _Listener(hub)
+
+    with deferred_messages(hub):
+        messages = [NumericalDataChangedMessage(data) for data in (first, second, first)]
+        for message in messages:
+            hub.broadcast(message)
+        assert listener.received == []
+
+    # The last message about `first`, in the place of the first one
+    assert listener.received == [messages[2], messages[1]]
+
+
+def test_nested_deferral_joins_the_outer_block():
+    data_collection = DataCollection()
+    hub = data_collection.hub
+    data = Data(x=[1], label="data")
+    data_collection.append(data)
+    listener = _Listener(hub)
+
+    with deferred_messages(hub):
+        with deferred_messages(hub):
+            hub.broadcast(NumericalDataChangedMessage(data))
+        assert listener.received == []
+        hub.broadcast(NumericalDataChangedMessage(data))
+
+    assert len(listener.received) == 1
+
+
+def test_ignored_messages_are_not_deferred():
+    data_collection = DataCollection()
+    hub = data_collection.hub
+    data = Data(x=[1], label="data")
+    data_collection.append(data)
+    listener = _Listener(hub)
+
+    with deferred_messages(hub):
+        with hub.ignore_callbacks(NumericalDataChangedMessage):
+            hub.broadcast(NumericalDataChangedMessage(data))
+
+    assert listener.received == []
@@ -0,0 +1,218 @@
+import pytest
+import numpy as np
+from glue.core import Data, DataCollection, Session
+from glue.core.subset import CategorySubsetState, MultiOrState
+
+from cosmicds.widgets.table.table import Table, _argsort
+
+
+def rows(keys, **values):
+    return {key: {"key": key, "value": values.get(str(key), key)} for key in keys}
+
+
+@pytest.fixture
+def make_table():
+    """Makes a table of rows keyed by ``keys`` (by default, 0 to 49), whose
+    values are ``value`` (by default, each row's key)."""
+
+    def make_table(value=None, keys=None, **kwargs) -> Table:
+        keys = list(range(50)) if keys is None else keys
+        data = Data(key=keys, value=keys if value is None else value, label="data")
+        session = Session(data_collection=DataCollection([data]))
+        table = Table(
+            session, data, glue_components=["key", "value"], use_subset_group=False, **kwargs
+        )
+        table.messages = []
+        table.send = table.messages.append
+        return table
+
+    return make_table
+
+
+def shown(table):
+    return [item["key"] for item in table.items]
+
+
+def test_first_fill_sends_every_row():
+    assert Table._diff({}, rows(range(3))) is None
+
+
+def test_changed_rows_are_patched():
+    old = rows(range(10))
+    new = rows([0, 1, 2, 4, 5, 6, 7, 8, 9, 10], **{"5": "changed"})
+
+    assert Table._diff(old, new) == {
+        "remove": [3],
+        "update": [{"key": 5, "value": "changed"}],
+        "insert": [[9, {"key": 10, "value": 10}]],
+    }
+
+
+def test_unchanged_rows_give_empty_patch():
+    patch = Table._diff(rows(range(5)), rows(range(5)))
+    assert not any(patch.values())
+
+
+def test_rows_holding_nan_are_not_updates():
+    nan = float("nan")
+    old = rows(range(5), **{"2": nan})
+    new = rows(range(5), **{"2": nan})
+
+    assert Table._diff(old, new) == {"remove": [], "update": [], "insert": []}
+
+
+def test_reordered_rows_are_resent():
+    assert Table._diff(rows([0, 1, 2, 3]), rows([1, 0, 2, 3])) is None
+
+
+def test_mostly_new_rows_are_resent():
+    assert Table._diff(rows(range(10)), rows(range(10, 20))) is None
+
+
+
+def test_window_moving_by_a_page_is_patched():
+    per_page = 10
+    # A window of three pages around page 3, then around page 4
+    old = rows(range(1 * per_page, 4 * per_page))
+    new = rows(range(2 * per_page, 5 * per_page))
+
+    patch = Table._diff(old, new)
+
+    assert patch["remove"] == list(range(10, 20))
+    assert [item["key"] for _, item in patch["insert"]] == list(range(40, 50))
+    assert patch["update"] == []
+
+
+def test_without_page_size_every_row_is_sent(make_table):
+    table = make_table()
+
+    assert not table.server_side
+    assert shown(table) == list(range(50))
+
+
+def test_window_holds_the_pages_around_the_current_one(make_table):
+    table = make_table(page_size=10)
+    assert table.server_items_length == 50
+    assert (table.window_start, shown(table)) == (0, list(range(20)))
+
+    table.page = 3
+    assert (table.window_start, shown(table)) == (10, list(range(10, 40)))
+
+    table.page = 5
+    assert (table.window_start, shown(table)) == (30, list(range(30, 50)))
+
+
+def test_wider_margin_holds_more_pages(make_table):
+    table = make_table(page_size=5, window_margin=2)
+    table.page = 4
+
+    assert (table.window_start, shown(table)) == (5, list(range(5, 30)))
+
+
+def test_page_past_the_end_is_clamped(make_table):
+    table = make_table(page_size=10)
+    table.page = 99
+
+    assert table.page == 5
+    assert shown(table) == list(range(30, 50))
+
+
+def test_all_rows_per_page_sends_every_row(make_table):
+    table = make_table(page_size=10)
+    table.items_per_page = -1
+
+    assert (table.window_start, shown(table)) == (0, list(range(50)))
+
+
+def test_next_page_is_sent_as_patch(make_table):
+    table = make_table(page_size=10)
+    table.page = 3
+    table.messages.clear()
+
+    table.page = 4
+
+    [message] = table.messages
+    assert message["method"] == "patch_items"
+    assert message["args"][0]["remove"] == list(range(10, 20))
+    assert shown(table) == list(range(20, 50))
+
+
+def test_argsort_puts_none_last():
+    assert _argsort(["b", None, "a"]).tolist() == [2, 0, 1]
+    assert _argsort([2, "a", None, 1]).tolist() == [3, 0, 1, 2]
+
+
+def test_window_follows_sort_order(make_table):
+    table = make_table(value=[49 - key for key in range(50)], page_size=10)
+
+    table.vue_update_sort_by(["value"])
+    assert shown(table) == list(range(49, 29, -1))
+
+    table.sort_desc = True
+    assert shown(table) == list(range(20))
+
+    # Clearing the sort goes back to data order
+    table.vue_update_sort_by([])
+    assert table.sort_by == "key"
+    assert shown(table) == list(range(20))
+
+
+def test_search_narrows_the_window(make_table):
+    table = make_table(page_size=2)
+    table.page = 3
+
+    table.search = "7"
+
+    assert table.page == 1
+    assert table.server_items_length == 5
+    assert shown(table) == [7, 17, 27, 37]
+
+
+def test_views_are_rebuilt_when_data_changes(make_table):
+    table = make_table(page_size=10)
+    table.search = "4"
+    assert table.server_items_length == 14
+
+    table.glue_data.update_components({table.glue_data.id["value"]: [4] * 50})
+
+    assert table.server_items_length == 50
+
+
+def selected_rows(table, state):
+    return np.flatnonzero(state.to_mask(table.glue_data)).tolist()
+
+
+def test_selection_of_numerical_keys(make_table):
+    table = make_table()
+    state = table.subset_state_from_selected([{"key": 7}, {"key": 3}])
+
+    assert isinstance(state, CategorySubsetState)
+    assert selected_rows(table, state) == [3, 7]
+
+
+def test_selection_of_categorical_keys(make_table):
+    table = make_table(keys=["a", "b", "c", "d"], value=[1, 2, 3, 4])
+    state = table.subset_state_from_selected([{"key": "d"}, {"key": "b"}])
+
+    assert isinstance(state, MultiOrState)
+    assert selected_rows(table, state) == [1, 3]
+
+
+def test_empty_selection_selects_nothing(make_table):
+    table = make_table()
+    state = table.subset_state_from_selected([])
+
+    assert selected_rows(table, state) == []
+
+
+def test_indices_of_unique_keys(make_table):
+    table = make_table()
+
+    assert table.indices_from_items([{"key": 9}, {"key": 2}, {"key": 99}]) == [2, 9]
+
+
+def test_indices_of_repeated_keys(make_table):
+    table = make_table(keys=[1, 1, 2, 3])
+
+    assert table._row_of_key is None
+    assert table.indices_from_items([{"key": 1}, {"key": 3}]) == [0, 1, 3]
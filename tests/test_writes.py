@@ -0,0 +1,62 @@
+import time
+
+from helpers import document, wait_for
+
+
+def test_burst_of_writes_is_coalesced(api, transport, stand_in):
+    api.writes.delay = api.writes.max_delay = 60
+    path = api.stage_state_path(1, "story", "stage")
+
+    for value in range(5):
+        api.put_stage_state(1, "story", "stage", {"value": value})
+    api.writes.flush(wait=True)
+
+    assert transport.methods == ["PUT"]
+    assert document(stand_in, path) == {"value": 4}
+
+
+def test_queued_write_is_read_back(api):
+    api.writes.delay = api.writes.max_delay = 60
+    api.put_stage_state(1, "story", "stage", {"value": 1})
+
+    assert api.client.run(api.get_stage_state(1, "story", "stage")) == {"value": 1}
+
+
+def test_failed_write_is_retried(api, transport, stand_in):
+    transport.failures = 2
+    path = api.stage_state_path(1, "story", "stage")
+
+    api.put_stage_state(1, "story", "stage", {"value": 1})
+
+    wait_for(lambda: document(stand_in, path) == {"value": 1})
+    assert transport.methods == ["PUT"] * 3
+
+
+def test_rejected_write_is_dropped(api, transport, stand_in):
+    transport.failures = 1
+    transport.status = 422
+    path = api.stage_state_path(1, "story", "stage")
+
+    api.put_stage_state(1, "story", "stage", {"value": 1})
+
+    wait_for(lambda: transport.methods)
+    time.sleep(0.2)
+    assert transport.methods == ["PUT"]
+    assert api.writes.pending(path) is None
+    assert document(stand_in, path) is None
+
+
+def test_delete_drops_queued_write(make_api, stand_in):
+    api = make_api(journal=True)
+    path = api.stage_state_path(1, "story", "stage")
+
+    api.put_stage_state(1, "story", "stage", {"value": 1})
+    api.writes.flush(wait=True)
+
+    api.writes.delay = api.writes.max_delay = 60
+    api.put_stage_state(1, "story", "stage", {"value": 2})
+    assert api.client.run(api.delete_stage_state(1, "story", "stage")) == {"success": True}
+    api.writes.flush(wait=True)
+
+    assert document(stand_in, path) is None
+    assert api.client.run(api.get_stage_state(1, "story", "stage")) is None